@@ -0,0 +1,135 @@
+""" 查询结果缓存
+    以 SQL 文本和参数为键缓存查询结果，每条结果有自己的过期时间，条目数超过 maxsize 时淘汰最久未使用的条目。
+    每条结果记录它读取的表，写语句经过 MySQLConnManager 时按表名让相关结果失效。
+
+    查询执行期间发生的写入可能让刚查出的结果已经过时，所以查询前先取 token()，
+    放入缓存时如果涉及的表在这之后失效过就不缓存。
+"""
+
+import collections
+import re
+import time
+
+# 从 SQL 中提取表名：FROM/JOIN/INTO/UPDATE 后面的标识符，复杂语句应显式传入 tables
+_TABLE_RE = re.compile(r"\b(?:from|join|into|update)\s+`?(?:\w+`?\.`?)?(\w+)`?", re.IGNORECASE)
+
+
+def tables_of(sql, tables=None):
+    """返回 SQL 中涉及的表名（小写），显式传入 tables 时以它为准"""
+    if tables is None:
+        tables = _TABLE_RE.findall(sql)
+    return frozenset(name.lower() for name in tables)
+
+
+def _freeze(params):
+    """把查询参数（包括嵌套的列表、元组、字典，比如 IN %s 的参数）转成可哈希的值"""
+    if isinstance(params, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in params.items()))
+    if isinstance(params, (list, tuple)):
+        return tuple(_freeze(p) for p in params)
+    if isinstance(params, (set, frozenset)):
+        return frozenset(_freeze(p) for p in params)
+    return params
+
+
+class QueryCache:
+    """带 TTL 和 LRU 淘汰的查询结果缓存"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        if maxsize < 1:
+            raise ValueError("maxsize should be greater than zero")
+        self.maxsize = maxsize
+        # 默认过期时间（秒）
+        self.ttl = ttl
+        # 键 -> (过期时间, 结果, 涉及的表)，按最近使用排序，队头最久未使用
+        self._entries = collections.OrderedDict()
+        # 表名 -> 读取了这个表的键
+        self._by_table = collections.defaultdict(set)
+        # 失效次数，用于判断查询期间是否有写入
+        self._generation = 0
+        self._invalidated_at = {}
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(sql, params=None):
+        """返回缓存键，参数中有无法哈希的值时返回 None，调用方应跳过缓存"""
+        key = sql, _freeze(params)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key, default=None):
+        """返回未过期的缓存结果并标记为最近使用，没有时返回 default"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._discard(key)
+        self.misses += 1
+        return default
+
+    def token(self):
+        """查询前调用，put() 据此判断查询期间涉及的表是否被写入过"""
+        return self._generation
+
+    def put(self, key, rows, tables, ttl=None, token=None):
+        """缓存查询结果，tables 为结果涉及的表，token 为查询前 token() 的返回值"""
+        if token is not None and any(self._invalidated_at.get(t, 0) > token for t in tables):
+            return
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        if key in self._entries:
+            self._discard(key)
+        self._entries[key] = (time.monotonic() + ttl, rows, tables)
+        for table in tables:
+            self._by_table[table].add(key)
+        while len(self._entries) > self.maxsize:
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, tables):
+        """让读取了这些表的缓存结果失效，返回失效的条目数"""
+        self._generation += 1
+        n = 0
+        for table in tables:
+            self._invalidated_at[table] = self._generation
+            for key in list(self._by_table.pop(table, ())):
+                if key in self._entries:
+                    self._discard(key)
+                    n += 1
+        return n
+
+    def clear(self):
+        self._entries.clear()
+        self._by_table.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _discard(self, key):
+        _, _, tables = self._entries.pop(key)
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
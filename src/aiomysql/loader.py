@@ -0,0 +1,105 @@
+""" 按主键批量加载（DataLoader 模式）
+    同一时间窗口内对同一张表的单行查询（WHERE emp_no = ?）先收集起来，合并成一条 WHERE emp_no IN (...) 查询，
+    再把结果按键分发给各个等待的协程，N 次往返变成一次，只占用一个连接。
+
+    用法:
+        loader = RowLoader(mgr, "employees", "emp_no")
+        rows = await asyncio.gather(*(loader.load(emp_no) for emp_no in emp_nos))
+"""
+
+import asyncio
+from src.aiomysql.utils import quote_name
+
+
+class RowLoader:
+
+    def __init__(self, mgr, table, key, columns=None, window=0.0, max_batch=500):
+        """
+        key: 唯一键的列名，结果按这一列分发，传给 load() 的键要和查询返回的值类型一致（比如都是 int）
+        columns: 要查询的列，None 表示所有列，返回的行不包含额外的键列
+        window: 收集键的时间（秒），0 表示只合并同一轮事件循环中的请求
+        max_batch: 一条查询最多的键数，收集满后立即查询
+        """
+        if max_batch < 1:
+            raise ValueError("max_batch should be greater than zero")
+        self._mgr = mgr
+        self._window = window
+        self._max_batch = max_batch
+        # 第一列总是键，用于分发结果
+        select = f"{quote_name(table)}.*" if columns is None else ", ".join(quote_name(c) for c in columns)
+        self._sql = (f"SELECT {quote_name(key)}, {select} FROM {quote_name(table)} "
+                     f"WHERE {quote_name(key)} IN ")
+        # 当前批次：键 -> Future
+        self._batch = {}
+        self._handle = None
+        # 正在查询的任务，保存引用避免被垃圾回收
+        self._tasks = set()
+        # 已经请求过的键 -> Future，查询中和得到结果的这一轮事件循环内，同一个键不会重复查询
+        self._cache = {}
+        # 统计：查询次数和加载的键数
+        self.queries = 0
+        self.loads = 0
+
+    async def load(self, key):
+        """返回键对应的行，不存在时返回 None"""
+        self.loads += 1
+        fut = self._cache.get(key)
+        if fut is None:
+            fut = self._enqueue(key)
+        # 多个调用方共享同一个 Future，shield 避免某个调用方被取消时连带取消其他调用方
+        return await asyncio.shield(fut)
+
+    async def load_many(self, keys):
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _enqueue(self, key):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._batch[key] = fut
+        self._cache[key] = fut
+        if len(self._batch) >= self._max_batch:
+            self._dispatch()
+        elif self._handle is None:
+            if self._window:
+                self._handle = loop.call_later(self._window, self._dispatch)
+            else:
+                self._handle = loop.call_soon(self._dispatch)
+        return fut
+
+    def _dispatch(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._batch = self._batch, {}
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._fetch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch):
+        self.queries += 1
+        keys = tuple(batch)
+        sql = self._sql + "(" + ", ".join(["%s"] * len(keys)) + ")"
+        try:
+            rows = await self._mgr.query(sql, keys, cache=False)
+        except asyncio.CancelledError:
+            for fut in batch.values():
+                fut.cancel()
+            raise
+        except Exception as exc:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(exc)
+        else:
+            found = {row[0]: row[1:] for row in rows}
+            for key, fut in batch.items():
+                if not fut.done():
+                    fut.set_result(found.get(key))
+        finally:
+            # 结果在本轮事件循环内可以直接复用，下一轮清理
+            asyncio.get_running_loop().call_soon(self._forget, batch)
+
+    def _forget(self, batch):
+        for key, fut in batch.items():
+            if self._cache.get(key) is fut:
+                del self._cache[key]
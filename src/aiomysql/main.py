@@ -3,17 +3,28 @@
 """
 
 import asyncio
+import itertools
 import aiomysql
+from src.aiomysql.cache import QueryCache, tables_of
+from src.aiomysql.singleflight import SingleFlight
+from src.aiomysql.utils import quote_name
+
+# 缓存未命中的标记，查询结果可能是空元组，不能用 None 判断
+_MISSING = object()
 
 
 class MySQLConnManager:
-    def __init__(self, host, port, user, password, db):
+    def __init__(self, host, port, user, password, db, cache_size=0, cache_ttl=60):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self.db = db
         self.pool = None
+        # 查询结果缓存，cache_size 为 0 时不缓存
+        self.cache = QueryCache(cache_size, cache_ttl) if cache_size else None
+        # 合并 SQL 和参数都相同的并发查询
+        self.singleflight = SingleFlight()
 
     async def init_pool(self):
         # 创建连接池
@@ -34,6 +45,178 @@ class MySQLConnManager:
         if conn is not None and self.pool is not None:
             self.pool.release(conn)
 
+    async def query(self, sql, params=None, ttl=None, tables=None, cache=True, coalesce=True):
+        """执行查询并返回所有行
+        开启缓存时先查缓存，未命中再查询数据库并缓存结果
+        ttl: 这条查询结果的缓存时间（秒），默认使用 cache_ttl，0 表示不缓存
+        tables: 结果涉及的表，用于写入时失效，默认从 SQL 中提取
+        coalesce: SQL 和参数都相同的查询正在执行时等待并共享它的结果（所有调用方拿到同一个结果对象），
+            只占用一个连接；有副作用的语句（比如 SELECT ... FOR UPDATE、调用存储过程）应传 False
+        """
+        # 参数无法哈希时 key 为 None，不查缓存也不合并
+        key = QueryCache.key(sql, params)
+        if cache and self.cache is not None and key is not None:
+            rows = self.cache.get(key, _MISSING)
+            if rows is not _MISSING:
+                return rows
+        if coalesce and key is not None:
+            return await self.singleflight.do(key, self._query, key, sql, params, ttl, tables, cache)
+        return await self._query(key, sql, params, ttl, tables, cache)
+
+    async def _query(self, key, sql, params, ttl, tables, cache):
+        """查询数据库并缓存结果"""
+        cache = self.cache if cache and key is not None else None
+        if cache is not None:
+            token = cache.token()
+        conn = await self.acquire_conn()
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                rows = await cur.fetchall()
+        finally:
+            self.release_conn(conn)
+        if cache is not None:
+            cache.put(key, rows, tables_of(sql, tables), ttl, token)
+        return rows
+
+    async def stream(self, sql, params=None, batch=1000, cursor_class=aiomysql.SSCursor):
+        """逐行返回查询结果的异步生成器，用于导出大表：
+            async with contextlib.aclosing(mgr.stream("select * from employees", batch=5000)) as rows:
+                async for row in rows:
+                    ...
+        使用服务端不缓冲的游标（SSCursor/SSDictCursor），每次从连接读取 batch 行，内存占用与结果集大小无关
+        读取结果集期间一直占用一个连接；调用方提前退出（break、异常）时直接关闭连接，不读完剩余的行。
+        提前退出时生成器要等到 aclose() 才会归还连接，不用 aclosing 的话要等垃圾回收，期间连接一直被占用
+        """
+        conn = await self.acquire_conn()
+        finished = False
+        try:
+            cur = await conn.cursor(cursor_class)
+            await cur.execute(sql, params)
+            while True:
+                rows = await cur.fetchmany(batch)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            await cur.close()
+            finished = True
+        finally:
+            if not finished:
+                # 结果集没有读完时连接上还有未读的数据，关闭连接，连接池不会再分配它
+                conn.close()
+            self.release_conn(conn)
+
+    async def execute(self, sql, params=None, tables=None):
+        """执行写语句（INSERT/UPDATE/DELETE）并提交，返回影响的行数
+        提交后让读取了相关表的缓存结果失效，tables 默认从 SQL 中提取
+        """
+        conn = await self.acquire_conn()
+        try:
+            async with conn.cursor() as cur:
+                affected = await cur.execute(sql, params)
+            await conn.commit()
+        finally:
+            self.release_conn(conn)
+        if self.cache is not None:
+            self.cache.invalidate(tables_of(sql, tables))
+        return affected
+
+    async def bulk_insert(self, table, rows, columns=None, chunk_rows=1000,
+                          max_packet_bytes=4 * 1024 * 1024, concurrency=4,
+                          chunk_transaction=True, update=None):
+        """批量写入，把 rows 拼成多行 INSERT ... VALUES 语句，在 concurrency 个连接上并发执行
+        rows: 元组（按 columns 的顺序）或字典的可迭代对象，可以是生成器，边读边写
+        columns: 列名，rows 是字典时默认取第一行的键
+        chunk_rows / max_packet_bytes: 每条语句最多的行数和字节数，max_packet_bytes 应小于服务端的 max_allowed_packet
+        chunk_transaction: 为 True 时每条语句单独一个事务，失败时只回滚这一块；
+            为 False 时每个连接写完所有块后提交一次，提交次数少但事务更大
+        update: 主键或唯一键冲突时要更新的列（ON DUPLICATE KEY UPDATE），None 表示普通插入
+        返回写入的行数、语句数、耗时和每秒写入行数；某一块写入失败时取消其他协程并抛出这个异常
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return {"rows": 0, "chunks": 0, "elapsed": 0.0, "rows_per_sec": 0.0}
+        if isinstance(first, dict):
+            if columns is None:
+                columns = list(first)
+            rows = (tuple(row[c] for c in columns) for row in itertools.chain([first], rows))
+        else:
+            if columns is None:
+                raise ValueError("columns is required when rows are not dicts")
+            rows = itertools.chain([first], rows)
+        prefix = (f"INSERT INTO {quote_name(table)} "
+                  f"({', '.join(quote_name(c) for c in columns)}) VALUES ")
+        suffix = ""
+        if update:
+            suffix = " ON DUPLICATE KEY UPDATE " + ", ".join(
+                f"{quote_name(c)} = VALUES({quote_name(c)})" for c in update)
+        overhead = len(prefix.encode()) + len(suffix.encode())
+        total = {"rows": 0, "chunks": 0}
+
+        async def worker():
+            # 每个协程用自己的连接，从共享的 rows 中取行拼语句；取行和拼语句是同步的，协程之间不会交错
+            # 先取出第一块的行再获取连接，行数不够 concurrency 块时多余的协程不占用连接
+            head = list(itertools.islice(rows, chunk_rows))
+            if not head:
+                return
+            source = itertools.chain(head, rows)
+            conn = await self.acquire_conn()
+            try:
+                carry = None
+                while True:
+                    values = []
+                    size = overhead
+                    if carry is not None:
+                        values.append(carry)
+                        size += len(carry.encode())
+                        carry = None
+                    while len(values) < chunk_rows:
+                        row = next(source, None)
+                        if row is None:
+                            break
+                        value = "(" + ", ".join(conn.escape(v) for v in row) + ")"
+                        # 单行超过 max_packet_bytes 时仍然单独发送，由服务端决定是否接受
+                        if values and size + len(value.encode()) + 2 > max_packet_bytes:
+                            carry = value
+                            break
+                        values.append(value)
+                        size += len(value.encode()) + 2
+                    if not values:
+                        break
+                    async with conn.cursor() as cur:
+                        await cur.execute(prefix + ", ".join(values) + suffix)
+                    if chunk_transaction:
+                        await conn.commit()
+                    total["rows"] += len(values)
+                    total["chunks"] += 1
+                if not chunk_transaction:
+                    await conn.commit()
+            except BaseException:
+                # 出错或被取消时连接上可能有未完成的语句和事务，直接关闭，服务端回滚未提交的数据
+                conn.close()
+                raise
+            finally:
+                self.release_conn(conn)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            # 任意一个协程失败时取消其他协程
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(concurrency):
+                    tg.create_task(worker())
+        except BaseExceptionGroup as eg:
+            # TaskGroup 把协程的异常包装成 ExceptionGroup，抛出第一个异常，调用方可以直接 except 具体的异常类型
+            raise eg.exceptions[0] from None
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(tables_of(None, [table.rsplit(".", 1)[-1]]))
+        elapsed = loop.time() - start
+        return dict(total, elapsed=elapsed,
+                    rows_per_sec=total["rows"] / elapsed if elapsed else 0.0)
+
     async def close(self):
         if self.pool is not None:
             self.pool.close()
@@ -0,0 +1,62 @@
+""" 合并相同的并发请求（singleflight）
+    同一个键同时只执行一次，执行期间到来的相同请求等待这次执行并共享结果（或异常）。
+
+    执行放在独立的任务中，调用方通过 shield 等待：
+    某个调用方被取消只影响它自己，只有所有调用方都取消后才取消执行，不浪费后端资源也不影响其他调用方。
+"""
+
+import asyncio
+
+
+class _Call:
+
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        # 仍在等待结果的调用方数量
+        self.waiters = 0
+
+
+class SingleFlight:
+
+    def __init__(self):
+        # 键 -> 正在执行的 _Call
+        self._calls = {}
+        # 统计：实际执行次数和被合并的请求数
+        self.executed = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, func, *args):
+        """执行 func(*args) 并返回结果，键相同的请求正在执行时等待它的结果"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.get_running_loop().create_task(func(*args)))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._forget(key, call))
+            call.task.add_done_callback(self._done)
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                # 所有调用方都已取消，先移除再取消，之后到来的相同请求重新执行
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    @staticmethod
+    def _done(task):
+        # 所有调用方都已取消时没有人读取异常，这里读取一次避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,438 @@
+import asyncio
+import contextlib
+import unittest
+from unittest import mock
+from src.aiomysql.cache import QueryCache, tables_of
+from src.aiomysql.loader import RowLoader
+from src.aiomysql.singleflight import SingleFlight
+from src.basic.pool.virtual_time import VirtualTimeTestCase
+
+try:
+    from src.aiomysql.main import MySQLConnManager
+except ImportError:
+    # 没有安装 aiomysql
+    MySQLConnManager = None
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.closed = False
+        self._rows = []
+
+    async def execute(self, sql, params=None):
+        if self.conn.error is not None:
+            raise self.conn.error
+        self.conn.executed.append(sql)
+        self._rows = list(self.conn.rows)
+        return len(self._rows)
+
+    async def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    async def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeCursorContext:
+    """和 aiomysql 一样，conn.cursor() 既可以 await 也可以 async with"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __await__(self):
+        yield from []
+        return self._cursor
+
+    async def __aenter__(self):
+        return self._cursor
+
+    async def __aexit__(self, *exc_info):
+        await self._cursor.close()
+
+
+class FakeConn:
+
+    def __init__(self, rows=(), error=None):
+        self.rows = rows
+        # 不为 None 时执行语句抛出这个异常
+        self.error = error
+        self.executed = []
+        self.cursors = []
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self, cursor_class=None):
+        cur = FakeCursor(self)
+        self.cursors.append(cur)
+        return FakeCursorContext(cur)
+
+    def escape(self, value):
+        return repr(value)
+
+    async def commit(self):
+        self.commits += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+
+    def __init__(self, rows=()):
+        self.rows = rows
+        self.error = None
+        self.conns = []
+        self.released = []
+
+    async def acquire(self):
+        conn = FakeConn(self.rows, self.error)
+        self.conns.append(conn)
+        return conn
+
+    def release(self, conn):
+        self.released.append(conn)
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_key(self):
+        # 嵌套的列表、字典（比如 IN %s 的参数）也能作为键，值相同的参数得到相同的键
+        key = QueryCache.key("select * from t where id in %s", ([1, 2], {"b": [3], "a": 1}))
+        self.assertEqual(key, QueryCache.key("select * from t where id in %s", ((1, 2), {"a": 1, "b": (3,)})))
+        hash(key)
+        # 无法哈希的参数返回 None，调用方跳过缓存
+        self.assertIsNone(QueryCache.key("select %s", (bytearray(b"x"),)))
+
+    def test_hit_and_miss(self):
+        cache = QueryCache()
+        key = QueryCache.key("select * from employees where emp_no = %s", (1,))
+        self.assertIsNone(cache.get(key))
+        cache.put(key, [(1,)], tables_of("select * from employees"))
+        self.assertEqual(cache.get(key), [(1,)])
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+
+    def test_lru_eviction(self):
+        cache = QueryCache(maxsize=2)
+        cache.put("a", 1, frozenset({"t"}))
+        cache.put("b", 2, frozenset({"t"}))
+        # 访问 a 后 b 成为最久未使用的条目
+        cache.get("a")
+        cache.put("c", 3, frozenset({"t"}))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_ttl(self):
+        cache = QueryCache(ttl=10)
+        with mock.patch("src.aiomysql.cache.time.monotonic", return_value=100):
+            cache.put("a", 1, frozenset({"t"}))
+            cache.put("b", 2, frozenset({"t"}), ttl=20)
+            # ttl 为 0 不缓存
+            cache.put("c", 3, frozenset({"t"}), ttl=0)
+        self.assertNotIn("c", cache._entries)
+        with mock.patch("src.aiomysql.cache.time.monotonic", return_value=110):
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get("b"), 2)
+        # 过期的条目被移除
+        self.assertEqual(len(cache), 1)
+
+    def test_invalidate(self):
+        cache = QueryCache()
+        cache.put("a", 1, frozenset({"employees"}))
+        cache.put("b", 2, frozenset({"employees", "salaries"}))
+        cache.put("c", 3, frozenset({"titles"}))
+        self.assertEqual(cache.invalidate(["salaries"]), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.invalidate(["employees"]), 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertNotIn("employees", cache._by_table)
+
+    def test_put_stale_token(self):
+        cache = QueryCache()
+        token = cache.token()
+        # 查询期间写入了 employees，查出的结果可能已经过时，不缓存
+        cache.invalidate(["employees"])
+        cache.put("a", 1, frozenset({"employees"}), token=token)
+        self.assertIsNone(cache.get("a"))
+        # 其他表的写入不影响
+        cache.put("b", 2, frozenset({"titles"}), token=token)
+        self.assertEqual(cache.get("b"), 2)
+        # 写入之后开始的查询可以缓存
+        cache.put("a", 1, frozenset({"employees"}), token=cache.token())
+        self.assertEqual(cache.get("a"), 1)
+
+    def test_tables_of(self):
+        sql = "select * from `db`.`Employees` e join salaries s on e.emp_no = s.emp_no"
+        self.assertEqual(tables_of(sql), {"employees", "salaries"})
+        self.assertEqual(tables_of(sql, ["T"]), {"t"})
+
+
+
+class TestSingleFlight(VirtualTimeTestCase):
+
+    async def test_coalesce(self):
+        sf = SingleFlight()
+        calls = []
+
+        async def fetch(x):
+            calls.append(x)
+            await asyncio.sleep(1)
+            return [x]
+
+        results = await asyncio.gather(*(sf.do("k", fetch, 1) for _ in range(3)), sf.do("other", fetch, 2))
+        self.assertEqual(calls, [1, 2])
+        # 合并的调用方拿到同一个结果对象
+        self.assertIs(results[0], results[1])
+        self.assertEqual(results[3], [2])
+        self.assertEqual((sf.executed, sf.coalesced), (2, 2))
+        self.assertEqual(len(sf), 0)
+        # 执行结束后相同的请求重新执行
+        await sf.do("k", fetch, 1)
+        self.assertEqual(calls, [1, 2, 1])
+
+    async def test_exception(self):
+        sf = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(1)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(sf.do("k", fail), sf.do("k", fail), return_exceptions=True)
+        self.assertIsInstance(results[0], ValueError)
+        self.assertIs(results[0], results[1])
+        self.assertEqual(sf.executed, 1)
+        self.assertEqual(len(sf), 0)
+
+    async def test_cancel_one_caller(self):
+        sf = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(1)
+            return "rows"
+
+        t1 = asyncio.create_task(sf.do("k", fetch))
+        t2 = asyncio.create_task(sf.do("k", fetch))
+        await asyncio.sleep(0.5)
+        t1.cancel()
+        # 取消一个调用方不影响其他调用方
+        self.assertEqual(await t2, "rows")
+        self.assertTrue(t1.cancelled())
+        self.assertEqual(sf.executed, 1)
+
+    async def test_cancel_all_callers(self):
+        sf = SingleFlight()
+        started = []
+        cancelled = []
+
+        async def fetch():
+            started.append(1)
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return "rows"
+
+        tasks = [asyncio.create_task(sf.do("k", fetch)) for _ in range(2)]
+        await asyncio.sleep(0.5)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 所有调用方都取消后取消执行并移除键
+        self.assertEqual(len(sf), 0)
+        await asyncio.sleep(0)
+        self.assertEqual(cancelled, [1])
+        # 之后到来的相同请求重新执行
+        self.assertEqual(await sf.do("k", fetch), "rows")
+        self.assertEqual(len(started), 2)
+
+
+class StubManager:
+    """只实现 RowLoader 用到的 query()，按 IN (...) 的参数返回 data 中的行"""
+
+    def __init__(self, data, error=None):
+        self.data = data
+        self.error = error
+        self.calls = []
+
+    async def query(self, sql, params=None, cache=True):
+        self.calls.append((sql, params))
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return [self.data[key] for key in params if key in self.data]
+
+
+class TestRowLoader(VirtualTimeTestCase):
+
+    def setUp(self):
+        self.mgr = StubManager({i: (i, f"name{i}") for i in range(10)})
+
+    async def test_batch(self):
+        loader = RowLoader(self.mgr, "db.employees", "emp_no", columns=["name"])
+        rows = await loader.load_many([1, 2, 3])
+        self.assertEqual(rows, [("name1",), ("name2",), ("name3",)])
+        # 同一轮事件循环中的请求合并成一条查询
+        sql, params = self.mgr.calls[0]
+        self.assertEqual(len(self.mgr.calls), 1)
+        self.assertEqual(params, (1, 2, 3))
+        self.assertEqual(sql, "SELECT `emp_no`, `name` FROM `db`.`employees` WHERE `emp_no` IN (%s, %s, %s)")
+        self.assertEqual((loader.queries, loader.loads), (1, 3))
+
+    async def test_window(self):
+        loader = RowLoader(self.mgr, "employees", "emp_no", window=0.1)
+        t1 = asyncio.create_task(loader.load(1))
+        await asyncio.sleep(0.05)
+        # 时间窗口内到来的请求也合并
+        rows = await asyncio.gather(t1, loader.load(2))
+        self.assertEqual(rows, [("name1",), ("name2",)])
+        self.assertEqual(len(self.mgr.calls), 1)
+        self.assertIn("`employees`.*", self.mgr.calls[0][0])
+
+    async def test_max_batch(self):
+        loader = RowLoader(self.mgr, "employees", "emp_no", window=10, max_batch=2)
+        task = asyncio.create_task(loader.load_many([1, 2, 3, 4, 5]))
+        await asyncio.sleep(1)
+        # 收集满 max_batch 个键后立即查询，不等时间窗口；剩下不满一批的键等窗口结束
+        self.assertEqual([params for _, params in self.mgr.calls], [(1, 2), (3, 4)])
+        self.assertFalse(task.done())
+        await asyncio.sleep(10)
+        self.assertEqual([params for _, params in self.mgr.calls], [(1, 2), (3, 4), (5,)])
+        self.assertEqual(await task, [(f"name{i}",) for i in range(1, 6)])
+        with self.assertRaises(ValueError):
+            RowLoader(self.mgr, "employees", "emp_no", max_batch=0)
+
+    async def test_repeated_and_missing_keys(self):
+        loader = RowLoader(self.mgr, "employees", "emp_no")
+        rows = await loader.load_many([1, 1, 42])
+        # 同一个键只查询一次，不存在的键返回 None
+        self.assertEqual(rows, [("name1",), ("name1",), None])
+        self.assertEqual(self.mgr.calls[0][1], (1, 42))
+        self.assertEqual(loader.loads, 3)
+        # 下一轮事件循环重新查询
+        await asyncio.sleep(0)
+        await loader.load(1)
+        self.assertEqual(len(self.mgr.calls), 2)
+
+    async def test_error(self):
+        self.mgr.error = RuntimeError("lost connection")
+        loader = RowLoader(self.mgr, "employees", "emp_no")
+        results = await asyncio.gather(loader.load(1), loader.load(2), return_exceptions=True)
+        # 一次查询失败，这一批的所有请求都失败
+        self.assertEqual(len(self.mgr.calls), 1)
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        # 失败的结果不会一直缓存
+        self.mgr.error = None
+        await asyncio.sleep(0)
+        self.assertEqual(await loader.load(1), ("name1",))
+
+
+@unittest.skipIf(MySQLConnManager is None, "aiomysql is not installed")
+class TestMySQLConnManager(VirtualTimeTestCase):
+
+    def manager(self, rows=()):
+        mgr = MySQLConnManager("localhost", 3306, "root", "", "test")
+        mgr.pool = FakePool(rows)
+        return mgr
+
+    async def test_query_coalesce(self):
+        mgr = self.manager([(1,)])
+        rows = await asyncio.gather(*(mgr.query("select 1") for _ in range(3)))
+        self.assertEqual(rows, [[(1,)]] * 3)
+        self.assertEqual(len(mgr.pool.conns), 1)
+        # 参数无法哈希时不合并，分别执行
+        rows = await asyncio.gather(*(mgr.query("select %s", (bytearray(b"x"),)) for _ in range(2)))
+        self.assertEqual(rows, [[(1,)]] * 2)
+        self.assertEqual(len(mgr.pool.conns), 3)
+        self.assertEqual(mgr.singleflight.executed, 1)
+
+    async def test_stream(self):
+        mgr = self.manager([(i,) for i in range(5)])
+        rows = [row async for row in mgr.stream("select id from t", batch=2)]
+        self.assertEqual(rows, [(i,) for i in range(5)])
+        # 读完后关闭游标并归还连接
+        conn, = mgr.pool.conns
+        self.assertTrue(conn.cursors[0].closed)
+        self.assertFalse(conn.closed)
+        self.assertEqual(mgr.pool.released, [conn])
+
+    async def test_stream_early_exit(self):
+        mgr = self.manager([(i,) for i in range(5)])
+        async with contextlib.aclosing(mgr.stream("select id from t", batch=2)) as rows:
+            async for row in rows:
+                if row == (2,):
+                    break
+            conn, = mgr.pool.conns
+            self.assertEqual(mgr.pool.released, [])
+        # 结果集没有读完，连接先关闭再归还，连接池不会再分配它
+        self.assertTrue(conn.closed)
+        self.assertEqual(mgr.pool.released, [conn])
+
+    async def test_bulk_insert(self):
+        mgr = self.manager()
+        rows = ({"id": i, "name": f"n{i}"} for i in range(10))
+        result = await mgr.bulk_insert("db.t", rows, chunk_rows=4, concurrency=2, update=["name"])
+        self.assertEqual(result["rows"], 10)
+        self.assertEqual(result["chunks"], 3)
+        executed = [sql for conn in mgr.pool.conns for sql in conn.executed]
+        self.assertEqual(len(executed), 3)
+        self.assertTrue(all(sql.startswith("INSERT INTO `db`.`t` (`id`, `name`) VALUES (") for sql in executed))
+        self.assertTrue(all(sql.endswith(" ON DUPLICATE KEY UPDATE `name` = VALUES(`name`)") for sql in executed))
+        self.assertEqual(sorted(sql.count("), (") + 1 for sql in executed), [2, 4, 4])
+        # 每块单独提交，所有连接都归还
+        self.assertEqual(sum(conn.commits for conn in mgr.pool.conns), 3)
+        self.assertEqual(len(mgr.pool.released), len(mgr.pool.conns))
+
+    async def test_bulk_insert_max_packet_bytes(self):
+        mgr = self.manager()
+        rows = [(i, "x" * 100) for i in range(6)]
+        result = await mgr.bulk_insert("t", rows, columns=["id", "v"], chunk_rows=100,
+                                       max_packet_bytes=300, concurrency=1)
+        self.assertEqual(result["rows"], 6)
+        conn, = mgr.pool.conns
+        self.assertEqual(len(conn.executed), result["chunks"])
+        self.assertGreater(result["chunks"], 1)
+        # 多行语句不超过 max_packet_bytes，行的顺序不变
+        for sql in conn.executed:
+            self.assertLessEqual(len(sql.encode()), 300)
+        ids = [int(v.split(",")[0]) for sql in conn.executed for v in sql.split("VALUES (")[1].split("), (")]
+        self.assertEqual(ids, list(range(6)))
+
+    async def test_bulk_insert_concurrency(self):
+        mgr = self.manager()
+        # 只有一块数据时只占用一个连接
+        result = await mgr.bulk_insert("t", [(1,), (2,)], columns=["id"], concurrency=4)
+        self.assertEqual(result["chunks"], 1)
+        self.assertEqual(len(mgr.pool.conns), 1)
+        result = await mgr.bulk_insert("t", [], columns=["id"])
+        self.assertEqual(result["rows"], 0)
+        self.assertEqual(len(mgr.pool.conns), 1)
+        with self.assertRaises(ValueError):
+            await mgr.bulk_insert("t", [(1,)])
+
+    async def test_bulk_insert_error(self):
+        mgr = self.manager()
+        mgr.pool.error = RuntimeError("duplicate entry")
+        # 抛出原始异常而不是 ExceptionGroup
+        with self.assertRaisesRegex(RuntimeError, "duplicate entry"):
+            await mgr.bulk_insert("t", [(i,) for i in range(10)], columns=["id"], chunk_rows=2)
+        # 出错的连接关闭后归还
+        self.assertTrue(mgr.pool.conns)
+        self.assertTrue(all(conn.closed for conn in mgr.pool.conns))
+        self.assertEqual(len(mgr.pool.released), len(mgr.pool.conns))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,6 @@
+""" 拼接 SQL 用的辅助函数，不依赖 aiomysql """
+
+
+def quote_name(name):
+    """给表名、列名加反引号，支持 db.table 的形式"""
+    return ".".join("`" + part.replace("`", "``") + "`" for part in name.split("."))
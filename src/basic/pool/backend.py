@@ -0,0 +1,87 @@
+""" 本地 TCP 模拟后端，用于连接池压测
+    协议是按行分隔的文本：
+        建立连接后服务端先发送 "OK\\n"（受 accept_rate 限制，模拟建连慢）
+        请求 "<id> <payload>\\n"，响应 "<id> <payload>\\n"，同一连接上的请求并发处理，响应可能乱序
+        "QUIT\\n" 关闭连接
+    每个请求按 error_rate 的概率直接断开连接，模拟后端故障。
+
+    用法:
+        server = LatencyServer(latency=0.001, jitter=0.002, error_rate=0.001)
+        await server.start()
+        pool = Pool(1, 10, -1, loop=loop, host=server.host, port=server.port)
+"""
+
+import asyncio
+import random
+
+
+class LatencyServer:
+
+    def __init__(self, latency=0.001, jitter=0.0, error_rate=0.0, accept_rate=None, seed=None):
+        # 每个请求的耗时为 latency + [0, jitter) 的随机值
+        self.latency = latency
+        self.jitter = jitter
+        # 每个请求直接断开连接的概率
+        self.error_rate = error_rate
+        # 每秒最多完成多少次建连握手，None 表示不限制
+        self.accept_rate = accept_rate
+        self._random = random.Random(seed)
+        self._next_accept = 0.0
+        self._server = None
+        self.host = None
+        self.port = None
+        # 统计
+        self.accepted = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _accept(self):
+        """按 accept_rate 排队完成握手"""
+        if self.accept_rate:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            at = max(now, self._next_accept)
+            self._next_accept = at + 1 / self.accept_rate
+            await asyncio.sleep(at - now)
+        self.accepted += 1
+
+    async def _handle(self, reader, writer):
+        tasks = set()
+        try:
+            await self._accept()
+            writer.write(b"OK\n")
+            while True:
+                line = await reader.readline()
+                if not line or line == b"QUIT\n":
+                    break
+                self.requests += 1
+                if self._random.random() < self.error_rate:
+                    self.errors += 1
+                    writer.transport.abort()
+                    return
+                req_id, _, payload = line.rstrip(b"\n").partition(b" ")
+                task = asyncio.create_task(self._respond(writer, req_id, payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _respond(self, writer, req_id, payload):
+        await asyncio.sleep(self.latency + self._random.random() * self.jitter)
+        if not writer.is_closing():
+            writer.write(req_id + b" " + payload + b"\n")
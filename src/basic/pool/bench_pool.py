@@ -0,0 +1,151 @@
+""" 连接池压测脚本
+    用法: PYTHONPATH=. python src/basic/pool/bench_pool.py
+"""
+
+import asyncio
+import time
+from src.basic.pool.pool import Pool
+from src.basic.pool.backend import LatencyServer
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def bench_contention(tasks=10000, minsize=10, maxsize=10, hold=0.0):
+    """tasks 个协程同时获取连接，统计总耗时、获取连接等待时间以及公平性
+
+    公平性用"获取到连接的顺序"与"开始等待的顺序"不一致的任务数衡量，FIFO 时为 0
+    """
+    loop = asyncio.get_running_loop()
+    pool = Pool(minsize, maxsize, -1, loop=loop)
+    waits = []
+    granted = []
+
+    async def worker(i):
+        start = loop.time()
+        async with pool.acquire():
+            waits.append(loop.time() - start)
+            granted.append(i)
+            await asyncio.sleep(hold)
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(tasks)))
+    elapsed = time.perf_counter() - begin
+    pool.close()
+    await pool.wait_closed()
+    unfair = sum(1 for pos, i in enumerate(granted) if pos != i)
+    return {
+        "tasks": tasks,
+        "elapsed": elapsed,
+        "p50_wait": percentile(waits, 0.5),
+        "p99_wait": percentile(waits, 0.99),
+        "max_wait": max(waits),
+        "out_of_order": unfair,
+    }
+
+
+async def bench_roundtrip(rounds=100000):
+    """单个协程反复获取、归还连接，统计每秒往返次数"""
+    loop = asyncio.get_running_loop()
+    pool = Pool(1, 1, -1, loop=loop)
+    async with pool.acquire():
+        pass
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        async with pool.acquire():
+            pass
+    elapsed = time.perf_counter() - begin
+    pool.close()
+    await pool.wait_closed()
+    return {"rounds": rounds, "elapsed": elapsed, "ops": rounds / elapsed}
+
+
+async def bench_free_policy(policy, workers=3, duration=0.5):
+    """先用突发流量把连接池撑到 maxsize，再用 workers 个协程持续请求
+
+    统计平稳阶段用到的不同连接数（越少局部性越好）和结束时的连接池大小
+    """
+    loop = asyncio.get_running_loop()
+    pool = Pool(1, 10, -1, loop=loop, reap_interval=0.02, idle_timeout=0.1,
+                free_policy=policy)
+
+    async def burst():
+        async with pool.acquire():
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(burst() for _ in range(10)))
+    peak = pool.size
+    used = set()
+    deadline = loop.time() + duration
+
+    async def worker():
+        while loop.time() < deadline:
+            async with pool.acquire() as conn:
+                used.add(conn.id)
+                await asyncio.sleep(0.001)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    size = pool.size
+    pool.close()
+    await pool.wait_closed()
+    return {"policy": policy, "peak": peak, "distinct": len(used), "size": size}
+
+
+async def bench_tcp(workers=50, requests=5000, maxsize=10, latency=0.001, jitter=0.002,
+                    error_rate=0.001, accept_rate=200):
+    """通过本地 TCP 后端压测：真实 socket、建连限速和随机断连"""
+    loop = asyncio.get_running_loop()
+    server = await LatencyServer(latency, jitter, error_rate, accept_rate, seed=1).start()
+    pool = Pool(1, maxsize, -1, loop=loop, host=server.host, port=server.port)
+    remaining = requests
+    failed = 0
+
+    async def worker():
+        nonlocal remaining, failed
+        while remaining > 0:
+            remaining -= 1
+            try:
+                async with pool.acquire() as conn:
+                    await conn.request("ping")
+            except ConnectionError:
+                failed += 1
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    elapsed = time.perf_counter() - begin
+    stats = pool.stats()
+    pool.close()
+    await pool.wait_closed()
+    await server.close()
+    return {"requests": requests, "elapsed": elapsed, "rps": requests / elapsed,
+            "failed": failed, "created": stats["created"],
+            "p99_wait": stats["acquire_wait"]["p99"]}
+
+
+async def main():
+    result = await bench_contention()
+    roundtrip = await bench_roundtrip()
+    policies = [await bench_free_policy(p) for p in ("fifo", "lifo", "oldest")]
+    tcp = await bench_tcp()
+    r = result
+    print(f"contention: {r['tasks']} tasks in {r['elapsed']:.3f}s, "
+          f"wait p50 {r['p50_wait'] * 1000:.2f}ms p99 {r['p99_wait'] * 1000:.2f}ms "
+          f"max {r['max_wait'] * 1000:.2f}ms, out of order {r['out_of_order']}")
+    r = roundtrip
+    print(f"roundtrip: {r['rounds']} acquire/release in {r['elapsed']:.3f}s, "
+          f"{r['ops']:.0f} ops/s")
+    for r in policies:
+        print(f"free_policy {r['policy']}: peak size {r['peak']}, "
+              f"{r['distinct']} distinct conns under steady load, final size {r['size']}")
+    r = tcp
+    print(f"tcp: {r['requests']} requests in {r['elapsed']:.3f}s, {r['rps']:.0f} req/s, "
+          f"{r['failed']} failed, {r['created']} connections created, "
+          f"acquire wait p99 <= {r['p99_wait'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,35 +1,60 @@
 import asyncio
+import logging
 from .utils import _ConnectionContextManager
 
+logger = logging.getLogger(__name__)
+
 
 class Conn:
 
     count = 0
     lock = asyncio.Lock()
+    # 模拟一次请求往返的耗时
+    latency = 0.01
 
     async def __init__(self):
         async with Conn.lock:
             Conn.count += 1
             self.id = Conn.count
         self.closed = False
+        # 创建时间和最近一次归还到连接池的时间（事件循环时钟），连接池据此判断连接是否超过 pool_recycle
+        self.created_at = self.last_usage = asyncio.get_running_loop().time()
+        # 最近一次从连接池借出的时间，以及抽样记录的获取位置（用于泄漏检测）
+        self.acquired_at = None
+        self.acquire_site = None
+        # 最近一次通过 acquire(key=...) 借出时的键，连接池据此把连接优先分配给同一个键（会话状态可复用）
+        self.affinity_key = None
+        # 为 True 时通过 logger 输出调试日志，由连接池按自己的 echo 设置
+        self.echo = False
 
     @classmethod
-    async def create(cls):
+    async def create(cls, *args, **kwargs):
         self = cls.__new__(cls)
-        await self.__init__()
+        await self.__init__(*args, **kwargs)
         return self
 
     def info(self):
         return self.id
 
+    async def request(self, payload):
+        """发送请求并等待响应，同一时间只能有一个请求"""
+        await asyncio.sleep(self.latency)
+        return payload
+
+    @property
+    def alive(self):
+        """连接是否可用，对应 aiomysql 中 _reader.at_eof() / _reader.exception() 的检查"""
+        return not self.closed
+
     def close(self):
         """关闭连接，关闭连接池或关闭最小连接数外长期空闲的连接时才会调用"""
         self.closed = True
-        print(f"Connection {self.id} closed")
+        if self.echo:
+            logger.debug("connection %s closed", self.id)
 
     async def ensure_closed(self):
-        print(
-            f"Connection {self.id}: waiting ack after send quit command to close...")
+        if self.echo:
+            logger.debug("connection %s: waiting ack after send quit command to close", self.id)
         await asyncio.sleep(1)
         self.close()
 
@@ -44,12 +69,102 @@ class Conn:
         return
 
 
-def connect():
-    coro = _connect()
+class MultiplexedConn(Conn):
+    """支持请求 ID 的连接，多个协程可以同时在一个连接上发送请求（pipeline），响应按请求 ID 匹配"""
+
+    async def __init__(self):
+        await super().__init__()
+        self._next_id = 0
+        # 请求 ID -> 等待响应的 Future
+        self._pending = {}
+
+    async def request(self, payload):
+        self._next_id += 1
+        req_id = self._next_id
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        self._send(req_id, payload)
+        try:
+            return await fut
+        finally:
+            self._pending.pop(req_id, None)
+
+    def _send(self, req_id, payload):
+        # 模拟后端：每个请求独立计时，响应可能乱序到达
+        asyncio.get_running_loop().call_later(self.latency, self._on_response, req_id, payload)
+
+    def _on_response(self, req_id, result):
+        fut = self._pending.pop(req_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result(result)
+
+    def close(self):
+        super().close()
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError(f"Connection {self.id} closed"))
+        self._pending.clear()
+
+
+class TcpConn(Conn):
+    """通过 TCP 连接真实 socket 后端的连接（见 backend.LatencyServer），协议为按行分隔的 "<id> <payload>" """
+
+    async def __init__(self, host, port):
+        await super().__init__()
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        try:
+            greeting = await self._reader.readline()
+            if greeting != b"OK\n":
+                raise ConnectionError(f"unexpected greeting: {greeting!r}")
+        except BaseException:
+            self._writer.close()
+            raise
+        self._next_id = 0
+
+    @property
+    def alive(self):
+        return not self.closed and not self._reader.at_eof() and self._reader.exception() is None
+
+    async def request(self, payload):
+        self._next_id += 1
+        req_id = str(self._next_id).encode()
+        try:
+            self._writer.write(req_id + b" " + str(payload).encode() + b"\n")
+            line = await self._reader.readline()
+        except BaseException:
+            # 请求被中断后连接上可能残留响应，不能再复用
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise ConnectionError(f"Connection {self.id} lost")
+        resp_id, _, result = line.rstrip(b"\n").partition(b" ")
+        assert resp_id == req_id, (resp_id, req_id)
+        return result.decode()
+
+    def close(self):
+        if not self.closed:
+            self._writer.close()
+        super().close()
+
+    async def ensure_closed(self):
+        if not self.closed:
+            try:
+                self._writer.write(b"QUIT\n")
+                await self._reader.read()
+            except ConnectionError:
+                pass
+        self.close()
+
+
+def connect(multiplexed=False, host=None, port=None):
+    coro = _connect(multiplexed, host, port)
     return _ConnectionContextManager(coro)
 
 
-async def _connect():
-    conn = await Conn.create()
-    print(f"created new conn, id: {conn.id}, {conn}")
+async def _connect(multiplexed=False, host=None, port=None):
+    if host is not None:
+        conn = await TcpConn.create(host, port)
+    else:
+        conn = await (MultiplexedConn if multiplexed else Conn).create()
     return conn
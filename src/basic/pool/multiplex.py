@@ -0,0 +1,121 @@
+""" 多路复用连接池
+    后端支持请求 ID 时，一个连接可以同时承载多个请求（见 conn.MultiplexedConn）。
+    MultiplexedPool 在 Pool 之上把每个连接拆成最多 max_streams 个通道（Channel），acquire() 返回通道而不是独占的连接，
+    并发不再受 Pool.maxsize 限制，少量昂贵的后端连接就能承载更多请求。
+
+    用法:
+        pool = Pool(1, 4, -1, loop=loop, multiplexed=True)
+        mpool = MultiplexedPool(pool, max_streams=16)
+        async with mpool.acquire() as channel:
+            result = await channel.request(payload)
+"""
+
+import asyncio
+from src.basic.pool.utils import _PoolAcquireContextManager
+
+
+class Channel:
+    """连接上的一个逻辑通道，轻量对象，请求通过所属连接发送"""
+
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @property
+    def conn(self):
+        return self._conn
+
+    async def request(self, payload):
+        return await self._conn.request(payload)
+
+
+class MultiplexedPool:
+
+    def __init__(self, pool, max_streams=8):
+        if max_streams < 1:
+            raise ValueError("max_streams should be greater than zero")
+        self._pool = pool
+        self._loop = pool._loop
+        self._max_streams = max_streams
+        # 从 Pool 借出的连接 -> 正在使用的通道数
+        self._streams = {}
+        # 正在从 Pool 借的连接数，同一时间只借一个，避免突发请求把连接池借空
+        self._opening = 0
+        # 通道或连接变化时完成的 Future，没有空闲通道的协程等待它后重新尝试
+        self._changed = None
+        self._nwaiters = 0
+
+    def acquire(self, timeout=None):
+        """获取一个通道，退出 async with 时归还"""
+        coro = self._acquire(timeout)
+        return _PoolAcquireContextManager(coro, self)
+
+    async def _acquire(self, timeout=None):
+        async with asyncio.timeout(timeout):
+            while True:
+                conn = self._least_loaded()
+                if conn is not None:
+                    self._streams[conn] += 1
+                    return Channel(conn)
+                if not self._opening and self._can_borrow():
+                    await self._borrow()
+                    continue
+                if self._changed is None:
+                    self._changed = self._loop.create_future()
+                self._nwaiters += 1
+                try:
+                    await asyncio.shield(self._changed)
+                except BaseException:
+                    # 等待超时或被取消，为等待者保留下来的空闲连接可能已经没人使用
+                    self._nwaiters -= 1
+                    self._release_idle()
+                    raise
+                self._nwaiters -= 1
+
+    def _can_borrow(self):
+        pool = self._pool
+        return (not self._streams or pool.freesize or pool.maxsize is None
+                or pool.size < pool.maxsize)
+
+    async def _borrow(self):
+        """从连接池借一个连接，借到后唤醒等待通道的协程"""
+        self._opening += 1
+        try:
+            conn = await self._pool._acquire()
+        finally:
+            self._opening -= 1
+            self._notify()
+        self._streams[conn] = 0
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set_result(None)
+            self._changed = None
+
+    def _least_loaded(self):
+        """返回还有空闲通道且通道最少的连接"""
+        best = None
+        for conn, n in self._streams.items():
+            if n < self._max_streams and not conn.closed and (best is None or n < self._streams[best]):
+                best = conn
+        return best
+
+    def _release_idle(self):
+        """没有协程等待通道时，把没有通道在使用的连接归还给连接池"""
+        if self._nwaiters:
+            return
+        for conn, n in list(self._streams.items()):
+            if not n:
+                del self._streams[conn]
+                self._pool.release(conn)
+
+    def release(self, channel):
+        """归还通道，连接上没有通道在使用且没有协程等待时把连接归还给连接池"""
+        conn = channel.conn
+        self._streams[conn] -= 1
+        self._notify()
+        if self._streams[conn] or (self._nwaiters and not conn.closed):
+            return self._pool._released
+        del self._streams[conn]
+        return self._pool.release(conn)
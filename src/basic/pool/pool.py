@@ -1,8 +1,173 @@
 import asyncio
+import bisect
 import collections
+import logging
+import random
+import sys
+import traceback
 from src.basic.pool.utils import _PoolAcquireContextManager
+from src.basic.pool.utils import _PoolAcquireManyContextManager
 from src.basic.pool.utils import _PoolConnectionContextManager
 from src.basic.pool.conn import connect
+from src.basic.pool.stats import PoolMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class PoolOverloadedError(RuntimeError):
+    """等待连接的协程过多或排队时间过长，获取连接被立即拒绝"""
+
+
+class CircuitOpenError(ConnectionError):
+    """连续建连失败后熔断器打开，需要新连接的获取请求被立即拒绝"""
+
+
+class _FreeList(collections.OrderedDict):
+    """空闲连接列表，按归还顺序排列（连接 -> None），同时按连接的 affinity_key 建立索引
+    提供和双端队列一致的 append/popleft/pop/remove，取队头/队尾、删除任意连接、按键取连接都是 O(1)
+    继承 OrderedDict 而不是包装它，len()/bool()/迭代都走 C 实现，不拖慢获取连接的快速路径
+    """
+
+    __slots__ = ('_by_key',)
+
+    def __init__(self):
+        super().__init__()
+        # affinity_key -> 该键的空闲连接（同样按归还顺序）
+        self._by_key = {}
+
+    def append(self, conn):
+        self[conn] = None
+        if conn.affinity_key is not None:
+            self._by_key.setdefault(conn.affinity_key, collections.OrderedDict())[conn] = None
+
+    def popleft(self):
+        conn, _ = self.popitem(last=False)
+        if conn.affinity_key is not None:
+            self._unindex(conn)
+        return conn
+
+    def pop(self):
+        conn, _ = self.popitem()
+        if conn.affinity_key is not None:
+            self._unindex(conn)
+        return conn
+
+    def remove(self, conn):
+        del self[conn]
+        if conn.affinity_key is not None:
+            self._unindex(conn)
+
+    def pop_key(self, key):
+        """取出最近归还的、上次使用键为 key 的连接，没有时返回 None"""
+        conns = self._by_key.get(key)
+        if not conns:
+            return None
+        conn, _ = conns.popitem()
+        if not conns:
+            del self._by_key[key]
+        del self[conn]
+        return conn
+
+    def clear(self):
+        super().clear()
+        self._by_key.clear()
+
+    def _unindex(self, conn):
+        conns = self._by_key[conn.affinity_key]
+        del conns[conn]
+        if not conns:
+            del self._by_key[conn.affinity_key]
+
+
+class _WaiterQueue:
+    """等待者队列，每个优先级一个先进先出队列，数字越小越优先
+    popleft() 默认取最优先的队列，低优先级队头的等待者被插队 starvation_limit 次后先服务它一次，
+    所以竞争激烈时低优先级至少分到 1/(starvation_limit+1) 的连接；starvation_limit 为 None 时严格按优先级
+    """
+
+    def __init__(self, starvation_limit=None):
+        # 优先级 -> 等待者 Future 的双端队列，队列为空时删除
+        self._queues = {}
+        # 有等待者的优先级，升序；只在出现新的优先级或某个优先级排空时调整，交付连接时不用排序
+        self._priorities = []
+        # 优先级 -> 队头等待者被插队的次数
+        self._skipped = {}
+        self._starvation_limit = starvation_limit
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def __bool__(self):
+        """是否还有未完成的等待者，顺便清理队头已取消的 Future"""
+        if not self._queues:
+            # 没有等待者时不分配对象，release() 的快速路径依赖这一点
+            return False
+        for priority in self._priorities[:]:
+            queue = self._queues[priority]
+            while queue and queue[0].done():
+                queue.popleft()
+            if not queue:
+                self._drop(priority)
+        return bool(self._queues)
+
+    def append(self, fut, priority=0):
+        queue = self._queues.get(priority)
+        if queue is None:
+            queue = self._queues[priority] = collections.deque()
+            bisect.insort(self._priorities, priority)
+        queue.append(fut)
+
+    def popleft(self):
+        """取出下一个应该被服务的等待者，队列为空时抛出 IndexError"""
+        if not self:
+            raise IndexError("pop from an empty waiter queue")
+        priorities = self._priorities
+        chosen = priorities[0]
+        if self._starvation_limit is not None and len(priorities) > 1:
+            for priority in priorities[1:]:
+                if self._skipped.get(priority, 0) >= self._starvation_limit:
+                    chosen = priority
+                    break
+            for priority in priorities:
+                if priority > chosen:
+                    self._skipped[priority] = self._skipped.get(priority, 0) + 1
+            self._skipped[chosen] = 0
+        queue = self._queues[chosen]
+        fut = queue.popleft()
+        if not queue:
+            self._drop(chosen)
+        return fut
+
+    def _drop(self, priority):
+        del self._queues[priority]
+        self._priorities.remove(priority)
+        self._skipped.pop(priority, None)
+
+
+class _GroupWaiter:
+    """acquire_many() 的等待者，收到 n 个连接后才完成
+    在 _waiters 中只占一个位置，分到第一个连接后移出队列成为 Pool._filling，凑齐之前所有连接都先交给它；
+    在 _nwaiters 中按还缺的连接数计数，_fill_free_pool() 据此一次性创建缺少的连接
+    """
+
+    __slots__ = ('fut', 'conns', 'missing')
+
+    def __init__(self, fut, n):
+        self.fut = fut
+        self.conns = []
+        self.missing = n
+
+    def done(self):
+        return self.fut.done()
+
+    def set_result(self, conn):
+        self.conns.append(conn)
+        self.missing -= 1
+        if not self.missing:
+            self.fut.set_result(self.conns)
+
+    def set_exception(self, exc):
+        self.fut.set_exception(exc)
 
 
 class Pool:
@@ -17,17 +182,32 @@ class Pool:
     2. 立即关闭： 先调用 terminate() 方法然后等待关闭完成 wait_closed()
     """
 
-    def __init__(self, minsize, maxsize, pool_recycle, loop, **kwargs):
+    def __init__(self, minsize, maxsize, pool_recycle, loop, reap_interval=None,
+                 acquire_timeout=None, connect_concurrency=None, echo=False,
+                 idle_timeout=None, grow_wait=None, free_policy="fifo",
+                 leak_threshold=None, leak_sample_rate=0.01,
+                 max_waiters=None, max_queue_wait=None, connect_backoff=0.1,
+                 connect_backoff_max=10, breaker_threshold=5, starvation_limit=8, **kwargs):
         if minsize < 0:
             raise ValueError("minsize should be zero or greater")
         if maxsize < minsize and maxsize != 0:
             raise ValueError("maxsize should be not less than minsize")
+        if free_policy not in ("fifo", "lifo", "oldest"):
+            raise ValueError("free_policy should be one of 'fifo', 'lifo', 'oldest'")
         # 连接池维持最小连接数
         self._minsize = minsize
         self._loop = loop
         self._conn_kwargs = kwargs
-        # 空闲连接的双端队列， maxsize or None 的意思是 maxsize 为"真值"取maxsize 否则取 None
-        self._free = collections.deque(maxlen=maxsize or None)
+        # 最大连接数， maxsize or None 的意思是 maxsize 为"真值"取maxsize 否则取 None（不限制）
+        # 连接数上限由 _fill_free_pool() 控制，ShardedPool 会在运行时调整这个值
+        self._maxsize = maxsize or None
+        # 空闲连接列表，按键取连接时通过它的 affinity_key 索引直接找到连接
+        self._free = _FreeList()
+        # 从 _free 取连接的策略，归还的连接总是放到队尾：
+        #   fifo: 取队头，轮流使用所有连接（默认）
+        #   lifo: 取队尾，集中使用最近归还的连接，冷连接可以被 idle_timeout 回收
+        #   oldest: 取最早创建的连接，让新连接保持空闲以便回收
+        self._free_policy = free_policy
         # 已经创建并被使用的连接
         self._used = set()
         # 已终止的连接，终止连接池才会用到
@@ -35,20 +215,74 @@ class Pool:
         # 这个异步条件变量两个功能：
         # 1. wait_closed() 中为了等待所有正在使用的连接都被回收完成，然后设置 _closed = True
         #   每清理一个被使用的连接都会唤醒 wait_closed() 中的循环判断，看被使用的连接是否都被清理完毕
-        # 2. _acquire() 中当 _free 列表为空时，需要等待插入新的连接或回收旧的连接
+        # 2. _acquire() 中检查和分配空闲连接时的互斥（创建连接在锁外进行）
         self._cond = asyncio.Condition()
-        # self._echo = echo
+        # 等待连接的协程对应的 Future，按 acquire(priority=...) 分级、同级先来后到排队，
+        # release() 时直接把连接交给下一个等待者；低优先级被插队 starvation_limit 次后服务一次，None 表示严格优先级
+        self._waiters = _WaiterQueue(starvation_limit)
+        # 已经分到部分连接的 acquire_many() 等待者，凑齐之前归还和新建的连接都先交给它（不受优先级影响），
+        # 所以同一时间最多一个等待者持有部分连接，不会出现多个等待者各持一部分连接互相等待
+        self._filling = None
+        # 仍在等待的协程数，_waiters 中可能残留已取消的 Future
+        self._nwaiters = 0
+        # 过载保护：等待者超过 max_waiters 个，或平均等待时间超过 max_queue_wait 秒时，
+        # 需要排队的 acquire() 直接抛出 PoolOverloadedError
+        self._max_waiters = max_waiters
+        self._max_queue_wait = max_queue_wait
+        # 为 True 时通过 logger 输出调试日志
+        self._echo = echo
+        # 连接空闲超过 pool_recycle 秒后回收，-1 表示不回收
         self._recycle = pool_recycle
-        # 四种状态
+        # 后台清理任务的执行间隔（秒），为 None 时在每次 _acquire() 中检查空闲连接
+        # 泄漏报告由后台清理任务完成，配置了 leak_threshold 而没有 reap_interval 时按 leak_threshold 的间隔启动
+        if reap_interval is None and leak_threshold is not None:
+            reap_interval = leak_threshold
+        self._reap_interval = reap_interval
+        self._reaper = None
+        # acquire() 未指定 timeout 时的默认超时时间（秒），None 表示一直等待
+        self._acquire_timeout = acquire_timeout
+        # 同时创建连接的最大数量，None 表示不限制（仍受 maxsize 约束）
+        self._connect_sem = (asyncio.Semaphore(connect_concurrency)
+                             if connect_concurrency else None)
+        # 自动伸缩：超过 minsize 的连接空闲 idle_timeout 秒后关闭，None 表示不收缩
+        self._idle_timeout = idle_timeout
+        # 自动伸缩：获取连接的平均等待时间超过 grow_wait 秒时，提前多创建一个连接
+        self._grow_wait = grow_wait
+        # 获取连接等待时间的指数移动平均
+        self._wait_avg = 0.0
+        # 泄漏检测：连接借出超过 leak_threshold 秒视为疑似泄漏，None 表示不检测
+        # 按 leak_sample_rate 的比例抽样记录获取连接的调用栈，便于定位泄漏位置
+        self._leak_threshold = leak_threshold
+        self._leak_sample_rate = leak_sample_rate if leak_threshold is not None else 0.0
+        # 已经报告过的泄漏连接 -> 报告时的 acquired_at，同一次借出只报告一次
+        self._leak_reported = {}
+        # 运行指标，通过 stats() 获取快照
+        self._metrics = PoolMetrics()
+        # 建连失败后按指数退避（带随机抖动）推迟下一次建连：connect_backoff * 2^(失败次数-1)，不超过 connect_backoff_max
+        self._connect_backoff = connect_backoff
+        self._connect_backoff_max = connect_backoff_max
+        self._connect_failures = 0
+        self._next_connect_at = 0.0
+        # 连续失败 breaker_threshold 次后熔断，退避时间到达后由后台探测建连，成功则恢复；None 表示不熔断
+        self._breaker_threshold = breaker_threshold
+        self._breaker_open = False
+        # 正在后台创建连接的任务
+        self._connecting = set()
+        # 正在创建中的连接数
         self._acquiring = 0
         # 是否正在关闭连接池
         self._closing = False
+        # 优雅关闭的截止时间（事件循环时钟），超过后 wait_closed() 强制终止，None 表示一直等待
+        self._close_deadline = None
         # 连接池是否已经关闭完成
         self._closed = False
+        # release() 返回的已完成 Future，复用同一个对象避免每次归还都分配
+        self._released = loop.create_future()
+        self._released.set_result(None)
 
-    # @property
-    # def echo(self):
-    #     return self._echo
+    @property
+    def echo(self):
+        return self._echo
 
     @property
     def minsize(self):
@@ -56,7 +290,7 @@ class Pool:
 
     @property
     def maxsize(self):
-        return self._free.maxlen
+        return self._maxsize
 
     @property
     def size(self):
@@ -66,45 +300,86 @@ class Pool:
     def freesize(self):
         return len(self._free)
 
+    def stats(self):
+        """连接池状态和运行指标的快照"""
+        stats = self._metrics.snapshot()
+        stats.update(
+            size=self.size,
+            freesize=self.freesize,
+            used=len(self._used),
+            acquiring=self._acquiring,
+            waiters=self._nwaiters,
+        )
+        return stats
+
     async def clear(self):
-        """清理连接池中所有的空闲连接"""
+        """清理连接池中所有的空闲连接，关闭握手在锁外并发进行"""
         async with self._cond:      # 这一行的作用从其异步上下文管理器的定义看就是先获取锁，然后执行代码块，最后释放锁，即线程安全地执行代码块
-            while self._free:
-                conn = self._free.popleft()
-                await conn.ensure_closed()
+            conns = list(self._free)
+            self._free.clear()
             # TODO 为什么
             self._cond.notify()
+        await self._ensure_closed_all(conns)
+
+    async def _ensure_closed_all(self, conns):
+        """并发向连接发送关闭命令，到达关闭截止时间后直接关闭剩余的连接"""
+        if not conns:
+            return
+        timeout = None
+        if self._close_deadline is not None:
+            timeout = max(0, self._close_deadline - self._loop.time())
+        tasks = [self._loop.create_task(conn.ensure_closed()) for conn in conns]
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        for conn in conns:
+            if not conn.closed:
+                conn.close()
+        self._metrics.closed += len(conns)
 
     @property
     def closed(self):
         """当所有的连接都关闭后返回 True"""
         return self._closed
 
-    def close(self):
+    def close(self, timeout=None):
         """关闭连接池，其实是优雅关闭线程池
         仅仅设置关闭中的状态，并不会立即关闭正在使用的连接，关闭连接池后续回收的连接会被关闭
         拒绝获取新连接
         需要配合 wait_closed() 使用
+        timeout: wait_closed() 最多等待 timeout 秒，超时后调用 terminate() 关闭仍在使用的连接
         """
         if self._closed:
             return
+        if timeout is not None:
+            self._close_deadline = self._loop.time() + timeout
         self._closing = True
+        if self._reaper is not None:
+            self._reaper.cancel()
+        waiter = self._next_waiter()
+        while waiter is not None:
+            self._fail_waiter(waiter, RuntimeError("Cannot acquire connection after closing pool"))
+            waiter = self._next_waiter()
 
     def terminate(self):
         """立即终止连接池，其实是立即终止使用中的连接
         会立即关闭所有的连接（包括使用中的）
         需要配合 wait_closed() 使用
         """
-        self.close()
+        self.close(timeout=0)
+        for task in list(self._connecting):
+            task.cancel()
         for conn in list(self._used):
-            conn.close()
+            self._close_conn(conn)
             self._terminated.add(conn)
         # 为何只清除 _used， 不清除 _free？因为 _free 被清除是借助 wait_closed() 方法实现，
         # 也即 terminate() 也需要配合 wait_closed() 使用
         self._used.clear()
 
     async def wait_closed(self):
-        """Wait for closing all pool's connections."""
+        """Wait for closing all pool's connections.
+        空闲连接并发完成关闭握手；close(timeout=...) 指定的截止时间到达后强制终止
+        """
 
         if self._closed:
             return
@@ -112,124 +387,462 @@ class Pool:
             raise RuntimeError(".wait_closed() should be called "
                                "after .close()")
 
-        while self._free:
-            conn = self._free.popleft()
-            conn.close()
+        conns = list(self._free)
+        self._free.clear()
+
+        if self._reaper is not None:
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+
+        await self._ensure_closed_all(conns)
 
         async with self._cond:
-            while self.size > self.freesize:    # 即有正在使用的连接，需要等待这些连接任务执行完成，全被回收后才能设置 _closed = True
-                await self._cond.wait()
+            try:
+                async with asyncio.timeout_at(self._close_deadline):
+                    while self.size > self.freesize:    # 即有正在使用的连接，需要等待这些连接任务执行完成，全被回收后才能设置 _closed = True
+                        await self._cond.wait()
+            except TimeoutError:
+                self.terminate()
         self._closed = True
 
-    def acquire(self):
+    def acquire(self, timeout=None, key=None, priority=0):
         """从连接池获取连接并在使用完连接后自动恢复到连接池
+        timeout 秒内获取不到连接抛出 TimeoutError，未指定时使用连接池的 acquire_timeout
+        key: 会话亲和键（比如租户 ID），优先分配上次以同一个键借出的空闲连接，没有时分配任意空闲连接
+        priority: 需要排队时的优先级，数字越小越优先，比如交互请求用 0、批处理任务用 1
         """
-        coro = self._acquire()
+        site = None
+        if self._leak_sample_rate and random.random() < self._leak_sample_rate:
+            site = traceback.extract_stack(sys._getframe(1), limit=5)
+        coro = self._acquire(timeout, site, key, priority)
         return _PoolAcquireContextManager(coro, self)
 
-    async def _acquire(self):
+    async def _acquire(self, timeout=None, site=None, key=None, priority=0):
         """从连接池获取连接
         如果 _free 中有空闲连接，直接从 _free 获取连接
-        _free 中没有空闲连接则等待 _fill_free_pool() 协程创建并插入空闲连接
+        _free 中没有空闲连接且无法创建新连接时，排到 _waiters 中对应优先级的队尾等待 release() 直接交付连接
+        """
+        if self._closing:
+            raise RuntimeError("Cannot acquire connection after closing pool")
+        if self._reap_interval is not None and self._reaper is None:
+            self._reaper = self._loop.create_task(self._reap())
+        if timeout is None:
+            timeout = self._acquire_timeout
+        # 超时时间覆盖等待锁、创建连接、排队等待的全过程
+        async with asyncio.timeout(timeout):
+            conn = await self._get_conn(key, priority)
+        conn.acquire_site = site
+        if key is not None:
+            conn.affinity_key = key
+        return conn
+
+    async def _get_conn(self, key=None, priority=0):
+        """取出空闲连接或排队等待，被取消时保证已交付的连接回到连接池"""
+        async with self._cond:
+            # 配置了后台清理任务时由 _reap() 定期检查，不在每次获取连接时检查
+            if self._reaper is None:
+                self._check_free_conns()
+            # 先满足排在前面的等待者，避免新来的协程插队
+            self._dispatch()
+            if self._free:
+                conn = None
+                if key is not None:
+                    conn = self._free.pop_key(key)
+                if conn is None:
+                    conn = self._pop_free()
+                assert not conn.closed, conn
+                assert conn not in self._used, (conn, self._used)
+                self._used.add(conn)
+                conn.acquired_at = self._loop.time()
+                self._wait_avg *= 0.9
+                self._metrics.acquire_wait.observe(0.0)
+                self._fill_free_pool(False)
+                return conn
+            if self._breaker_open and (self._maxsize is None or self.size < self._maxsize):
+                # 需要新连接但后端不可用，不再排队等待
+                raise CircuitOpenError("Backend unavailable, circuit breaker is open")
+            if self.is_saturated():
+                raise PoolOverloadedError(
+                    f"Pool is overloaded: {self._nwaiters} waiters, "
+                    f"average wait {self._wait_avg:.3f}s")
+            fut = self._loop.create_future()
+            self._waiters.append(fut, priority)
+            self._nwaiters += 1
+            # 连接在锁外并发创建，创建完成后直接交给最早的等待者
+            self._fill_free_pool(True)
+            start = self._loop.time()
+        try:
+            conn = await fut
+            wait = self._loop.time() - start
+            self._wait_avg = self._wait_avg * 0.9 + wait * 0.1
+            self._metrics.acquire_wait.observe(wait)
+            return conn
+        except BaseException:
+            if fut.cancelled():
+                self._nwaiters -= 1
+            # 连接已经交付但协程被取消，归还连接避免泄漏
+            elif fut.done() and fut.exception() is None:
+                self.release(fut.result())
+            raise
+
+    def acquire_many(self, n, timeout=None, priority=0):
+        """原子地获取 n 个连接，要么一次拿到全部，要么一个都不占用地排队等待
+        返回的上下文管理器进入时得到连接列表，退出时归还全部连接
+        排队期间分到的连接留在等待者手里，不会交给调用方，凑齐前超时或被取消时全部归还；
+        分到第一个连接后，之后的连接都先交给它直到凑齐（不论其他等待者的优先级），
+        所以不会有多个等待者各自持有一部分连接互相等待；缺少的连接一次性并发创建
         """
+        if n < 1:
+            raise ValueError("n should be greater than zero")
+        if self._maxsize is not None and n > self._maxsize:
+            raise ValueError("n should be not greater than maxsize")
+        site = None
+        if self._leak_sample_rate and random.random() < self._leak_sample_rate:
+            site = traceback.extract_stack(sys._getframe(1), limit=5)
+        coro = self._acquire_many(n, timeout, priority, site)
+        return _PoolAcquireManyContextManager(coro, self)
+
+    async def _acquire_many(self, n, timeout=None, priority=0, site=None):
         if self._closing:
             raise RuntimeError("Cannot acquire connection after closing pool")
+        if self._reap_interval is not None and self._reaper is None:
+            self._reaper = self._loop.create_task(self._reap())
+        if timeout is None:
+            timeout = self._acquire_timeout
+        async with asyncio.timeout(timeout):
+            conns = await self._get_conns(n, priority)
+        for conn in conns:
+            conn.acquire_site = site
+        return conns
+
+    async def _get_conns(self, n, priority=0):
+        """一次取出 n 个空闲连接，不够时作为一个等待者排队，被取消或失败时归还已分到的连接"""
         async with self._cond:
-            while True:
-                await self._fill_free_pool(True)
-                if self._free:
-                    conn = self._free.popleft()
-                    assert not conn.closed, conn
-                    assert conn not in self._used, (conn, self._used)
+            if self._reaper is None:
+                self._check_free_conns()
+            self._dispatch()
+            if not self._has_waiters() and len(self._free) >= n:
+                now = self._loop.time()
+                conns = [self._pop_free() for _ in range(n)]
+                for conn in conns:
                     self._used.add(conn)
-                    return conn
-                else:
-                    await self._cond.wait()
-
-    async def _fill_free_pool(self, override_min):
-        # iterate over free connections and remove timed out ones
-        free_size = len(self._free)
-        n = 0
-
-        # 检查连接的健康状态，异常则直接关闭连接
-        # while n < free_size:
-        #     conn = self._free[-1]
-
-        #     if conn._reader.at_eof() or conn._reader.exception():
-        #         self._free.pop()
-        #         conn.close()
-
-        #     On MySQL 8.0 a timed out connection sends an error packet before
-        #     closing the connection, preventing us from relying on at_eof().
-        #     This relies on our custom StreamReader, as eof_received is not
-        #     present in asyncio.StreamReader.
-        #     elif conn._reader.eof_received:
-        #         self._free.pop()
-        #         conn.close()
-
-        #     elif (self._recycle > -1 and
-        #           self._loop.time() - conn.last_usage > self._recycle):
-        #         self._free.pop()
-        #         conn.close()
-
-        #     else:
-        #         self._free.rotate()
-        #     n += 1
-
-        while self.size < self.minsize:
-            self._acquiring += 1
-            try:
-                # conn = await connect(echo=self._echo, loop=self._loop,
-                #                      **self._conn_kwargs)
-                conn = await connect()
-                # raise exception if pool is closing
-                self._free.append(conn)
-                self._cond.notify()
-            finally:
-                self._acquiring -= 1
-        if self._free:
+                    conn.acquired_at = now
+                    self._metrics.acquire_wait.observe(0.0)
+                self._wait_avg *= 0.9
+                self._fill_free_pool(False)
+                return conns
+            if self._breaker_open and (self._maxsize is None or self.size < self._maxsize):
+                raise CircuitOpenError("Backend unavailable, circuit breaker is open")
+            if self.is_saturated():
+                raise PoolOverloadedError(
+                    f"Pool is overloaded: {self._nwaiters} waiters, "
+                    f"average wait {self._wait_avg:.3f}s")
+            waiter = _GroupWaiter(self._loop.create_future(), n)
+            self._waiters.append(waiter, priority)
+            self._nwaiters += n
+            # 没有排在前面的等待者时，现有的空闲连接先分给它，缺少的连接一次性并发创建
+            self._dispatch()
+            self._fill_free_pool(True)
+            start = self._loop.time()
+        try:
+            conns = await waiter.fut
+            wait = self._loop.time() - start
+            self._wait_avg = self._wait_avg * 0.9 + wait * 0.1
+            for _ in conns:
+                self._metrics.acquire_wait.observe(wait)
+            return conns
+        except BaseException:
+            if waiter.fut.cancelled():
+                self._nwaiters -= waiter.missing
+            # 已经分到的连接（包括刚凑齐但协程被取消的情况）全部归还
+            for conn in waiter.conns:
+                self.release(conn)
+            raise
+
+    def _fill_free_pool(self, override_min):
+        """在后台并发创建连接补足 minsize
+        override_min 为 True 时还会为尚未分到连接的等待者创建连接（不超过 maxsize）
+        配置了 grow_wait 时，平均等待时间偏高且没有空闲连接则提前多创建一个
+        """
+        n = self.minsize - self.size
+        if override_min:
+            n = max(n, self._nwaiters - self._acquiring)
+        if (self._grow_wait is not None and self._wait_avg > self._grow_wait and
+                not self._free):
+            # 等待时间持续偏高，在需求之前多创建一个连接
+            n = max(n, 0) + 1
+        if self._maxsize is not None:
+            n = min(n, self._maxsize - self.size)
+        if self._breaker_open:
+            # 熔断期间只由 _probe() 探测建连
+            return []
+        return [self._spawn_conn() for _ in range(n)]
+
+    def _spawn_conn(self):
+        self._acquiring += 1
+        task = self._loop.create_task(self._create_conn())
+        self._connecting.add(task)
+        task.add_done_callback(self._connecting.discard)
+        return task
+
+    async def _create_conn(self):
+        """创建一个连接并交给最早的等待者，没有等待者时放入 _free
+        创建失败时把异常交给最早的等待者并返回该异常
+        """
+        try:
+            # 上次建连失败后的退避时间
+            delay = self._next_connect_at - self._loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._connect_sem is None:
+                start = self._loop.time()
+                conn = await connect(**self._conn_kwargs)
+            else:
+                async with self._connect_sem:
+                    start = self._loop.time()
+                    conn = await connect(**self._conn_kwargs)
+            self._metrics.connect.observe(self._loop.time() - start)
+            self._metrics.created += 1
+        except Exception as exc:
+            self._connect_failed()
+            waiter = self._next_waiter()
+            if waiter is not None:
+                self._fail_waiter(waiter, exc)
+            return exc
+        finally:
+            self._acquiring -= 1
+            if self._closing:
+                # 唤醒 wait_closed()
+                self._loop.create_task(self._wakeup())
+        self._connect_failures = 0
+        self._next_connect_at = 0.0
+        conn.echo = self._echo
+        if self._echo:
+            logger.debug("created new connection %s", conn.id)
+        if self._closing:
+            self._close_conn(conn)
+            return conn
+        if not self._wakeup_waiter(conn):
+            self._free.append(conn)
+        if self._breaker_open:
+            # 探测成功，后端恢复，为等待者和 minsize 补充连接
+            self._breaker_open = False
+            logger.warning("backend recovered, circuit breaker closed")
+            self._fill_free_pool(True)
+        return conn
+
+    def _connect_failed(self):
+        """记录一次建连失败，计算下次建连的退避时间，连续失败过多时打开熔断器"""
+        self._connect_failures += 1
+        delay = min(self._connect_backoff_max,
+                    self._connect_backoff * 2 ** (self._connect_failures - 1))
+        # 抖动：在 [delay/2, delay) 之间随机，避免多个连接池同时重试
+        delay = delay / 2 + random.random() * delay / 2
+        self._next_connect_at = self._loop.time() + delay
+        if (self._breaker_threshold is None or self._closing or
+                self._connect_failures < self._breaker_threshold):
             return
-
-        if override_min and (not self.maxsize or self.size < self.maxsize):
-            self._acquiring += 1
-            try:
-                # conn = await connect(echo=self._echo, loop=self._loop,
-                #                      **self._conn_kwargs)
-                conn = await connect()
-                # raise exception if pool is closing
-                self._free.append(conn)
-                self._cond.notify()
-            finally:
-                self._acquiring -= 1
+        if not self._breaker_open:
+            self._breaker_open = True
+            logger.warning("%d consecutive connect failures, circuit breaker opened",
+                           self._connect_failures)
+            # 熔断后不再让等待者继续等待新连接
+            waiter = self._next_waiter()
+            while waiter is not None:
+                self._fail_waiter(waiter,
+                                  CircuitOpenError("Backend unavailable, circuit breaker is open"))
+                waiter = self._next_waiter()
+        # 半开：退避时间到达后只创建一个探测连接
+        self._loop.call_later(delay, self._probe)
+
+    def _probe(self):
+        if self._breaker_open and not self._closing and not self._acquiring:
+            self._spawn_conn()
+
+    async def warmup(self):
+        """在流量到来前并发创建连接补足 minsize，耗时约为一次建连的时间"""
+        if self._breaker_open:
+            raise CircuitOpenError("Backend unavailable, circuit breaker is open")
+        async with self._cond:
+            tasks = self._fill_free_pool(False)
+        for result in await asyncio.gather(*tasks):
+            if isinstance(result, Exception):
+                raise result
+
+    def _check_free_conns(self):
+        """检查空闲连接的健康状态，关闭已断开或空闲超过 pool_recycle 的连接
+        配置了 idle_timeout 时，还会把空闲过久的连接关闭到只剩 minsize 个
+        """
+        now = self._loop.time()
+        for conn in list(self._free):
+            if not conn.alive:
+                self._free.remove(conn)
+                self._close_conn(conn)
+            elif (self._recycle > -1 and
+                  now - conn.last_usage > self._recycle):
+                self._free.remove(conn)
+                self._close_conn(conn)
+                self._metrics.recycled += 1
+            elif (self._idle_timeout is not None and self.size > self.minsize and
+                  now - conn.last_usage > self._idle_timeout):
+                self._free.remove(conn)
+                self._close_conn(conn)
+
+    async def _reap(self):
+        """后台清理任务，每隔 reap_interval 秒检查一次空闲连接并补足最小连接数"""
+        while not self._closing:
+            await asyncio.sleep(self._reap_interval)
+            async with self._cond:
+                self._check_free_conns()
+                self._fill_free_pool(False)
+            if self._leak_threshold is not None:
+                self._report_leaks()
+
+    def is_saturated(self):
+        """连接池是否已经饱和，为 True 时需要排队的 acquire() 会被拒绝
+        调用方可以据此提前降级，而不是继续排队
+        """
+        if self._max_waiters is not None and self._nwaiters >= self._max_waiters:
+            return True
+        if self._max_queue_wait is not None and self._wait_avg > self._max_queue_wait:
+            # 平均等待时间只在有空闲连接时下降；没有等待者且还能新建连接时不会排队，
+            # 否则突发流量后连接被 idle_timeout 收缩完，过期的平均值会让之后的获取一直被拒绝
+            if self._nwaiters or (self._maxsize is not None and self.size >= self._maxsize):
+                return True
+        return False
+
+    def leaks(self, threshold=None):
+        """返回借出时间超过 threshold 秒（默认 leak_threshold）的连接，按借出时长降序
+        site 为抽样记录的获取位置，未被抽样时为 None
+        """
+        if threshold is None:
+            threshold = self._leak_threshold
+        if threshold is None:
+            return []
+        now = self._loop.time()
+        leaks = [
+            {
+                "id": conn.id,
+                "held": now - conn.acquired_at,
+                "site": "".join(conn.acquire_site.format()) if conn.acquire_site else None,
+            }
+            for conn in self._used
+            if now - conn.acquired_at > threshold
+        ]
+        leaks.sort(key=lambda leak: leak["held"], reverse=True)
+        return leaks
+
+    def _report_leaks(self):
+        """记录疑似泄漏的连接，每次借出只报告一次"""
+        reported = {}
+        for conn in self._used:
+            if self._loop.time() - conn.acquired_at <= self._leak_threshold:
+                continue
+            reported[conn] = conn.acquired_at
+            if self._leak_reported.get(conn) == conn.acquired_at:
+                continue
+            logger.warning("connection %s held for %.1fs, possible leak, acquired at:\n%s",
+                           conn.id, self._loop.time() - conn.acquired_at,
+                           "".join(conn.acquire_site.format()) if conn.acquire_site
+                           else "(not sampled)")
+        self._leak_reported = reported
+
+    def _close_conn(self, conn):
+        conn.close()
+        self._metrics.closed += 1
+
+    def _wakeup_waiter(self, conn):
+        """把连接直接交给下一个等待者（同一优先级中等待最久的），没有等待者时返回 False"""
+        waiter = self._next_waiter()
+        if waiter is None:
+            return False
+        self._nwaiters -= 1
+        self._used.add(conn)
+        conn.acquired_at = self._loop.time()
+        waiter.set_result(conn)
+        # acquire_many() 的等待者还没凑齐时，之后的连接都先交给它
+        self._filling = None if waiter.done() else waiter
+        return True
+
+    def _next_waiter(self):
+        """返回下一个应该分到连接的未完成等待者，没有时返回 None
+        正在凑连接的 acquire_many() 等待者优先，其余按 _waiters 的顺序
+        """
+        if self._filling is not None:
+            if not self._filling.done():
+                return self._filling
+            self._filling = None
+        # _waiters 为真时队头一定有未完成的等待者
+        if self._waiters:
+            return self._waiters.popleft()
+        return None
+
+    def _has_waiters(self):
+        return (self._filling is not None and not self._filling.done()) or bool(self._waiters)
+
+    def _fail_waiter(self, waiter, exc):
+        """让等待者以 exc 失败，已完成（已取消）的等待者忽略"""
+        if waiter.done():
+            return
+        if isinstance(waiter, _GroupWaiter):
+            # 已经分到的连接由 _get_conns() 归还
+            self._nwaiters -= waiter.missing
+        else:
+            self._nwaiters -= 1
+        waiter.set_exception(exc)
+
+    def _pop_free(self):
+        """按 free_policy 从 _free 中取出一个连接"""
+        if self._free_policy == "fifo":
+            return self._free.popleft()
+        if self._free_policy == "lifo":
+            return self._free.pop()
+        conn = min(self._free, key=lambda c: c.created_at)
+        self._free.remove(conn)
+        return conn
+
+    def _dispatch(self):
+        """把空闲连接依次交给等待者"""
+        while self._free and self._has_waiters():
+            self._wakeup_waiter(self._pop_free())
 
     async def _wakeup(self):
         async with self._cond:
+            if not self._closing and self._nwaiters:
+                # 被归还的连接已关闭，为等待者补充新连接
+                self._fill_free_pool(True)
+                self._dispatch()
             self._cond.notify()
 
     def release(self, conn):
         """Release free connection back to the connection pool.
 
         This is **NOT** a coroutine.
+        没有等待者且连接正常时不创建任务、不分配对象
         """
-        fut = self._loop.create_future()
-        fut.set_result(None)
-
         if conn in self._terminated:
             assert conn.closed, conn
             self._terminated.remove(conn)
-            return fut
+            return self._released
         assert conn in self._used, (conn, self._used)
         self._used.remove(conn)
-        if not conn.closed:
-            if self._closing:
-                conn.close()
-            else:
+        now = self._loop.time()
+        self._metrics.hold.observe(now - conn.acquired_at)
+        if not conn.closed and not self._closing:
+            conn.last_usage = now
+            if not self._wakeup_waiter(conn):
                 self._free.append(conn)
-                print(f"self._free: {self._free}")
-            # 使用当前事件循环创建任务
-            print(f"release, loop id: {id(self._loop)}")
-            fut = self._loop.create_task(self._wakeup())
-        return fut
+            return self._released
+        if not conn.closed:
+            conn.close()
+        self._metrics.closed += 1
+        if self._echo:
+            logger.debug("release closed connection %s, free: %d", conn.id, len(self._free))
+        # 被归还的连接已关闭，需要唤醒 wait_closed() 或为等待者补充连接
+        return self._loop.create_task(self._wakeup())
 
     def __enter__(self):
         raise RuntimeError(
@@ -0,0 +1,133 @@
+""" 多事件循环分片连接池
+    每个线程一个事件循环时（见 src/asyncio/event_loop.py），Pool 只能服务创建它的事件循环。
+    ShardedPool 为每个事件循环创建一个分片（Pool），所有分片共享一个全局 maxsize 预算。
+
+    获取、归还连接只访问当前事件循环自己的分片，不加跨线程的锁；
+    预算调整由每个分片的后台任务定期在自己的事件循环中进行，只在调整时短暂持有全局锁：
+    1. 分片有等待者时从空闲预算中申请容量，不够则登记缺口
+    2. 分片没有等待者时归还未被连接占用的容量
+    3. 其他分片有缺口时，关闭自己超过 minsize 的空闲连接让出容量
+    连接绑定在创建它的事件循环上，不能在分片间移动，分片间转移的是连接数预算。
+"""
+
+import asyncio
+import threading
+from src.basic.pool.pool import Pool
+
+
+class ShardedPool:
+    """按事件循环分片的连接池，maxsize 是所有分片共享的连接数上限"""
+
+    def __init__(self, minsize, maxsize, pool_recycle, rebalance_interval=0.5, **kwargs):
+        if minsize < 0:
+            raise ValueError("minsize should be zero or greater")
+        if maxsize < 1:
+            raise ValueError("maxsize should be greater than zero")
+        # 每个分片的最小连接数（预算不足时会更少）
+        self._minsize = minsize
+        self._maxsize = maxsize
+        self._recycle = pool_recycle
+        self._rebalance_interval = rebalance_interval
+        self._pool_kwargs = kwargs
+        # 事件循环 -> 分片
+        self._shards = {}
+        # 还没有分配给任何分片的连接数预算
+        self._spare = maxsize
+        # 分片 -> 还缺少的容量
+        self._wants = {}
+        # 保护 _shards/_spare/_wants 以及调整分片的 maxsize
+        self._lock = threading.Lock()
+        self._rebalancers = {}
+        self._closing = False
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def size(self):
+        return sum(pool.size for pool in list(self._shards.values()))
+
+    def shard(self):
+        """返回当前事件循环的分片，不存在时创建"""
+        loop = asyncio.get_running_loop()
+        pool = self._shards.get(loop)
+        if pool is not None:
+            return pool
+        if self._closing:
+            raise RuntimeError("Cannot acquire connection after closing pool")
+        with self._lock:
+            grant = min(self._spare, max(self._minsize, 1))
+            self._spare -= grant
+            pool = Pool(min(self._minsize, grant), max(grant, 1), self._recycle,
+                        loop=loop, **self._pool_kwargs)
+            pool._maxsize = grant
+            self._shards[loop] = pool
+        self._rebalancers[loop] = loop.create_task(self._rebalance(pool))
+        return pool
+
+    def acquire(self, timeout=None):
+        """从当前事件循环的分片获取连接"""
+        return self.shard().acquire(timeout)
+
+    def release(self, conn):
+        """归还连接，必须在获取连接的事件循环中调用"""
+        return self.shard().release(conn)
+
+    async def _rebalance(self, pool):
+        while not pool._closing:
+            await asyncio.sleep(self._rebalance_interval)
+            self._rebalance_shard(pool)
+
+    def _rebalance_shard(self, pool):
+        """在分片自己的事件循环中调整它的容量"""
+        grant = 0
+        with self._lock:
+            self._wants.pop(pool, None)
+            if pool._nwaiters:
+                need = pool._nwaiters - pool._acquiring
+                grant = min(max(need, 0), self._spare)
+                self._spare -= grant
+                pool._maxsize += grant
+                if need > grant:
+                    self._wants[pool] = need - grant
+            else:
+                # 归还没有被连接占用的容量
+                unused = pool._maxsize - max(pool.size, pool.minsize)
+                if unused > 0:
+                    pool._maxsize -= unused
+                    self._spare += unused
+                # 其他分片缺容量时，关闭自己的空闲连接让出容量
+                wanted = sum(self._wants.values())
+                while wanted > self._spare and pool.freesize and pool.size > pool.minsize:
+                    pool._close_conn(pool._free.popleft())
+                    pool._maxsize -= 1
+                    self._spare += 1
+        if grant:
+            pool._fill_free_pool(True)
+
+    def close(self):
+        """关闭所有分片，需要配合 wait_closed() 使用"""
+        self._closing = True
+        for loop, pool in list(self._shards.items()):
+            loop.call_soon_threadsafe(pool.close)
+
+    async def wait_closed(self):
+        """等待所有分片关闭，其他事件循环的分片在它们自己的事件循环中关闭"""
+        self._closing = True
+        current = asyncio.get_running_loop()
+        waits = []
+        for loop, pool in list(self._shards.items()):
+            if loop is current:
+                waits.append(self._close_shard(pool))
+            else:
+                waits.append(asyncio.wrap_future(
+                    asyncio.run_coroutine_threadsafe(self._close_shard(pool), loop)))
+        await asyncio.gather(*waits)
+
+    async def _close_shard(self, pool):
+        pool.close()
+        await pool.wait_closed()
+        task = self._rebalancers.pop(pool._loop, None)
+        if task is not None:
+            task.cancel()
@@ -0,0 +1,87 @@
+""" 连接池指标
+    计数器和固定桶直方图，记录时只做整数加法和一次二分查找，开销足够小可以常开
+"""
+
+import asyncio
+import bisect
+
+
+class Histogram:
+    """固定桶的耗时直方图（单位：秒）"""
+
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        # 最后一个桶记录超过 5 秒的值
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """返回第 q 分位所在桶的上界，近似值"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class PoolMetrics:
+    """连接池运行指标，由 Pool 在获取、归还、创建、关闭连接时更新"""
+
+    __slots__ = ('created', 'closed', 'recycled', 'acquire_wait', 'hold', 'connect')
+
+    def __init__(self):
+        # 创建、关闭的连接数
+        self.created = 0
+        self.closed = 0
+        # 因空闲超过 pool_recycle 被回收的连接数
+        self.recycled = 0
+        # 获取连接的等待时间、连接被借出的时长、建立连接的耗时
+        self.acquire_wait = Histogram()
+        self.hold = Histogram()
+        self.connect = Histogram()
+
+    def snapshot(self):
+        return {
+            "created": self.created,
+            "closed": self.closed,
+            "recycled": self.recycled,
+            "acquire_wait": self.acquire_wait.snapshot(),
+            "hold": self.hold.snapshot(),
+            "connect": self.connect.snapshot(),
+        }
+
+
+async def export_periodically(pool, interval, exporter=print):
+    """每隔 interval 秒把 pool.stats() 交给 exporter，连接池关闭后退出
+
+    用法: loop.create_task(export_periodically(pool, 10, logger.info))
+    """
+    while not pool.closed:
+        await asyncio.sleep(interval)
+        exporter(pool.stats())
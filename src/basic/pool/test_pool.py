@@ -1,17 +1,24 @@
 import os
 import asyncio
+import contextlib
+import io
+import logging
+import random
+import threading
 import time
-from src.basic.pool.pool import Pool
+import unittest
+from unittest import mock
+from src.basic.pool.pool import Pool, PoolOverloadedError, CircuitOpenError
+from src.basic.pool.conn import Conn
+from src.basic.pool.stats import export_periodically
+from src.basic.pool.threadsafe import ThreadSafePool
+from src.basic.pool.sharded import ShardedPool
+from src.basic.pool.multiplex import MultiplexedPool
+from src.basic.pool.backend import LatencyServer
+from src.basic.pool.virtual_time import VirtualTimeTestCase
 
-pypath = os.environ.get("PYTHONPATH")
-print(f"pypath: {pypath}")
 
-loop = asyncio.get_event_loop()
-print(f"loop id: {id(loop)}")
-pool = Pool(2, 4, 300, loop=loop)
-
-
-async def async_task():
+async def async_task(pool):
     async with pool.acquire() as conn:
         print(f"use conn object: {conn.info()}, begin: {time.time()}")
         # 模拟业务执行
@@ -20,10 +27,720 @@ async def async_task():
         print(f"use conn object: {conn.info()} done, end: {time.time()}")
 
 
-async def test_pool():
-    tasks = [loop.create_task(async_task()) for _ in range(5)]
+async def demo_pool():
+    """演示：5 个协程共享最多 4 个连接，直接运行本文件时执行（不以 test_ 开头，pytest 不会收集）"""
+    loop = asyncio.get_running_loop()
+    print(f"loop id: {id(loop)}")
+    pool = Pool(2, 4, 300, loop=loop)
+    tasks = [loop.create_task(async_task(pool)) for _ in range(5)]
     await asyncio.gather(*tasks)
 
+
+class TestPool(VirtualTimeTestCase):
+
+    async def asyncSetUp(self):
+        self.loop = asyncio.get_running_loop()
+
+    async def test_recycle(self):
+        """空闲超过 pool_recycle 的连接在下次获取时被关闭并替换"""
+        pool = Pool(1, 2, 0.05, loop=self.loop)
+        async with pool.acquire() as conn:
+            pass
+        await asyncio.sleep(0.1)
+        async with pool.acquire() as conn2:
+            self.assertIsNot(conn, conn2)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.size, 1)
+
+    async def test_broken_conn(self):
+        """已断开的空闲连接不会被分配出去"""
+        pool = Pool(1, 2, -1, loop=self.loop)
+        async with pool.acquire() as conn:
+            pass
+        conn.closed = True
+        async with pool.acquire() as conn2:
+            self.assertIsNot(conn, conn2)
+            self.assertFalse(conn2.closed)
+
+    async def test_reaper(self):
+        """后台清理任务回收过期连接并补足最小连接数"""
+        pool = Pool(1, 2, 0.05, loop=self.loop, reap_interval=0.02)
+        async with pool.acquire() as conn:
+            pass
+        await asyncio.sleep(0.15)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.freesize, 1)
+        pool.close()
+        await pool.wait_closed()
+        self.assertTrue(pool.closed)
+
+    async def test_fifo_waiters(self):
+        """归还的连接按等待顺序交给等待者"""
+        pool = Pool(1, 1, -1, loop=self.loop)
+        order = []
+
+        async def waiter(i):
+            async with pool.acquire():
+                order.append(i)
+
+        async with pool.acquire():
+            tasks = [self.loop.create_task(waiter(i)) for i in range(5)]
+            await asyncio.sleep(0)
+            self.assertEqual(len(pool._waiters), 5)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+
+    async def test_cancelled_waiter(self):
+        """被取消的等待者不会占用连接"""
+        pool = Pool(1, 1, -1, loop=self.loop)
+        async with pool.acquire():
+            task = self.loop.create_task(pool._acquire())
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertEqual(pool.freesize, 1)
+        self.assertEqual(len(pool._used), 0)
+
+    async def test_close_fails_waiters(self):
+        pool = Pool(1, 1, -1, loop=self.loop)
+        conn = await pool._acquire()
+        task = self.loop.create_task(pool._acquire())
+        await asyncio.sleep(0)
+        pool.close()
+        with self.assertRaises(RuntimeError):
+            await task
+        await pool.release(conn)
+        await pool.wait_closed()
+
+    async def test_acquire_timeout(self):
+        """连接耗尽时在超时时间内失败，且不会泄漏连接"""
+        pool = Pool(1, 1, -1, loop=self.loop, acquire_timeout=0.05)
+        async with pool.acquire():
+            with self.assertRaises(TimeoutError):
+                await pool.acquire()
+            with self.assertRaises(TimeoutError):
+                async with pool.acquire(timeout=0.01):
+                    pass
+        self.assertEqual(pool.freesize, 1)
+        self.assertEqual(pool.size, 1)
+
+    async def test_cancel_after_handoff(self):
+        """连接已交付给等待者但等待者被取消时，连接回到连接池"""
+        pool = Pool(1, 1, -1, loop=self.loop)
+        conn = await pool._acquire()
+        task = self.loop.create_task(pool._acquire())
+        await asyncio.sleep(0)
+        pool.release(conn)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(pool.freesize, 1)
+        self.assertEqual(len(pool._used), 0)
+
+    async def test_warmup(self):
+        """warmup() 并发创建 minsize 个连接，connect_concurrency 限制并发数"""
+        active = 0
+        peak = 0
+
+        async def slow_connect():
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.05)
+            active -= 1
+            return await Conn.create()
+
+        with mock.patch("src.basic.pool.pool.connect", slow_connect):
+            pool = Pool(8, 8, -1, loop=self.loop)
+            start = self.loop.time()
+            await pool.warmup()
+            self.assertLess(self.loop.time() - start, 0.1)
+            self.assertEqual(pool.freesize, 8)
+            self.assertEqual(peak, 8)
+
+            peak = 0
+            pool = Pool(4, 4, -1, loop=self.loop, connect_concurrency=2)
+            await pool.warmup()
+            self.assertEqual(pool.freesize, 4)
+            self.assertEqual(peak, 2)
+
+    async def test_release_while_connecting(self):
+        """创建连接期间不持有锁，其他协程可以正常获取和归还连接"""
+        async def slow_connect():
+            await asyncio.sleep(0.2)
+            return await Conn.create()
+
+        pool = Pool(0, 2, -1, loop=self.loop)
+        conn = await pool._acquire()
+        with mock.patch("src.basic.pool.pool.connect", slow_connect):
+            task = self.loop.create_task(pool._acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(pool._acquiring, 1)
+            pool.release(conn)
+            self.assertIs(await asyncio.wait_for(task, 0.05), conn)
+            conn2 = await pool._acquire()
+            self.assertIsNot(conn, conn2)
+
+    async def test_connect_error(self):
+        """建连失败时异常交给等待的协程"""
+        async def broken_connect():
+            raise ConnectionError("backend down")
+
+        pool = Pool(0, 1, -1, loop=self.loop)
+        with mock.patch("src.basic.pool.pool.connect", broken_connect):
+            with self.assertRaises(ConnectionError):
+                await pool._acquire()
+        self.assertEqual(pool.size, 0)
+
+    async def test_release_fast_path(self):
+        """没有等待者时归还连接不创建任务"""
+        pool = Pool(1, 1, -1, loop=self.loop)
+        conn = await pool._acquire()
+        tasks = len(asyncio.all_tasks())
+        fut = pool.release(conn)
+        self.assertTrue(fut.done())
+        self.assertEqual(len(asyncio.all_tasks()), tasks)
+        conn = await pool._acquire()
+        self.assertIs(pool.release(conn), fut)
+
+    async def test_echo(self):
+        """调试输出只在 echo=True 时通过 logger 输出，不写标准输出"""
+        for echo in (False, True):
+            pool = Pool(1, 1, -1, loop=self.loop, echo=echo)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out), self.assertLogs("src.basic.pool", "DEBUG") as logs:
+                # assertLogs 要求至少一条日志
+                logging.getLogger("src.basic.pool").debug("start")
+                await pool.warmup()
+                conn = await pool._acquire()
+                conn.close()
+                await pool.release(conn)
+            self.assertEqual(out.getvalue(), "")
+            self.assertEqual(len(logs.records) > 1, echo, logs.output)
+
+    async def test_shrink_idle(self):
+        """超过 minsize 的连接空闲 idle_timeout 后被关闭"""
+        pool = Pool(1, 4, -1, loop=self.loop, reap_interval=0.02, idle_timeout=0.05)
+        conns = [await pool._acquire() for _ in range(4)]
+        for conn in conns:
+            pool.release(conn)
+        self.assertEqual(pool.size, 4)
+        await asyncio.sleep(0.15)
+        self.assertEqual(pool.size, 1)
+        pool.close()
+        await pool.wait_closed()
+
+    async def test_grow_ahead(self):
+        """平均等待时间偏高时提前创建连接"""
+        pool = Pool(0, 4, -1, loop=self.loop, grow_wait=0.01)
+        pool._wait_avg = 0.05
+        await pool._acquire()
+        await asyncio.sleep(0)
+        self.assertEqual(pool.size, 2)
+        self.assertEqual(pool.freesize, 1)
+
+    async def test_stats(self):
+        pool = Pool(1, 2, 0.05, loop=self.loop)
+        async with pool.acquire():
+            task = self.loop.create_task(pool._acquire())
+            async with pool.acquire():
+                await asyncio.sleep(0)
+                self.assertEqual(pool.stats()["waiters"], 1)
+        conn = await task
+        pool.release(conn)
+        await asyncio.sleep(0.1)
+        async with pool.acquire():
+            pass
+        stats = pool.stats()
+        self.assertEqual(stats["created"], 3)
+        self.assertEqual(stats["recycled"], 2)
+        self.assertEqual(stats["closed"], 2)
+        self.assertEqual(stats["acquire_wait"]["count"], 4)
+        self.assertEqual(stats["hold"]["count"], 4)
+        self.assertEqual(stats["connect"]["count"], 3)
+        self.assertEqual(stats["size"], 1)
+
+        exported = []
+        exporter = self.loop.create_task(export_periodically(pool, 0.01, exported.append))
+        await asyncio.sleep(0.05)
+        pool.close()
+        await pool.wait_closed()
+        await exporter
+        self.assertTrue(exported)
+
+    async def test_free_policy(self):
+        """fifo 取最早归还的连接，lifo 取最近归还的连接，oldest 取最早创建的连接"""
+        expected = {"fifo": 1, "lifo": 0, "oldest": 2}
+        for policy, index in expected.items():
+            pool = Pool(0, 3, -1, loop=self.loop, free_policy=policy)
+            conns = [await pool._acquire() for _ in range(3)]
+            await asyncio.sleep(0)
+            for i in (1, 2, 0):
+                pool.release(conns[i])
+            conns[2].created_at -= 10
+            conn = await pool._acquire()
+            self.assertIs(conn, conns[index], policy)
+        with self.assertRaises(ValueError):
+            Pool(0, 3, -1, loop=self.loop, free_policy="random")
+
+    async def test_clear_concurrent(self):
+        """clear() 并发关闭空闲连接，期间不阻塞获取连接"""
+        pool = Pool(10, 10, -1, loop=self.loop)
+        await pool.warmup()
+        conns = list(pool._free)
+        start = self.loop.time()
+        task = self.loop.create_task(pool.clear())
+        await asyncio.sleep(0)
+        conn = await asyncio.wait_for(pool._acquire(), 0.1)
+        await task
+        self.assertLess(self.loop.time() - start, 1.5)
+        self.assertTrue(all(c.closed for c in conns))
+        pool.release(conn)
+
+    async def test_close_timeout(self):
+        """close(timeout=...) 到期后终止仍在使用的连接"""
+        pool = Pool(1, 2, -1, loop=self.loop)
+        conn = await pool._acquire()
+        start = self.loop.time()
+        pool.close(timeout=0.05)
+        await pool.wait_closed()
+        self.assertLess(self.loop.time() - start, 0.5)
+        self.assertTrue(pool.closed)
+        self.assertTrue(conn.closed)
+        pool.release(conn)
+        self.assertEqual(pool.size, 0)
+
+    async def test_leak_detector(self):
+        """借出超过阈值的连接被报告，并带有抽样记录的获取位置"""
+        pool = Pool(1, 2, -1, loop=self.loop, reap_interval=0.02,
+                    leak_threshold=0.05, leak_sample_rate=1.0)
+        with self.assertLogs("src.basic.pool.pool", "WARNING") as logs:
+            async with pool.acquire() as conn:
+                await asyncio.sleep(0.15)
+                leaks = pool.leaks()
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual([leak["id"] for leak in leaks], [conn.id])
+        self.assertIn("test_leak_detector", leaks[0]["site"])
+        self.assertEqual(pool.leaks(), [])
+        pool.close()
+        await pool.wait_closed()
+
+        # 没有配置 reap_interval 时也会启动后台任务报告泄漏
+        pool = Pool(1, 2, -1, loop=self.loop, leak_threshold=0.05)
+        with self.assertLogs("src.basic.pool.pool", "WARNING") as logs:
+            async with pool.acquire():
+                await asyncio.sleep(0.15)
+        self.assertEqual(len(logs.records), 1)
+        pool.close()
+        await pool.wait_closed()
+
+        # acquire_many() 同样记录获取位置，不残留上一次 acquire() 的调用栈
+        pool = Pool(2, 2, -1, loop=self.loop, leak_threshold=10, leak_sample_rate=1.0)
+        async with pool.acquire():
+            pass
+        async with pool.acquire_many(2) as conns:
+            for conn in conns:
+                self.assertIn("test_leak_detector", "".join(conn.acquire_site.format()))
+        pool._leak_sample_rate = 0.0
+        async with pool.acquire_many(2) as conns:
+            self.assertEqual([conn.acquire_site for conn in conns], [None, None])
+        pool.close()
+        await pool.wait_closed()
+
+    async def test_load_shedding(self):
+        """等待者达到 max_waiters 后立即拒绝，等待者减少后恢复"""
+        pool = Pool(1, 1, -1, loop=self.loop, max_waiters=2)
+        conn = await pool._acquire()
+        tasks = [self.loop.create_task(pool._acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        self.assertTrue(pool.is_saturated())
+        with self.assertRaises(PoolOverloadedError):
+            await pool._acquire()
+        tasks[0].cancel()
+        await asyncio.sleep(0)
+        self.assertFalse(pool.is_saturated())
+        pool.release(conn)
+        pool.release(await tasks[1])
+        self.assertEqual(pool.stats()["waiters"], 0)
+
+        pool = Pool(1, 1, -1, loop=self.loop, max_queue_wait=0.01)
+        await pool.warmup()
+        pool._wait_avg = 0.05
+        async with pool.acquire():
+            with self.assertRaises(PoolOverloadedError):
+                await pool._acquire()
+
+        # 突发流量后连接全部空闲收缩，之后的获取不应被过期的平均等待时间拒绝
+        pool = Pool(0, 1, -1, loop=self.loop, reap_interval=0.02, idle_timeout=0.05,
+                    max_queue_wait=0.01)
+        async with pool.acquire():
+            pass
+        pool._wait_avg = 0.05
+        await asyncio.sleep(0.2)
+        self.assertEqual(pool.size, 0)
+        self.assertFalse(pool.is_saturated())
+        async with pool.acquire():
+            pass
+
+    async def test_virtual_clock(self):
+        """虚拟时钟下 sleep 不消耗真实时间"""
+        start = time.perf_counter()
+        await asyncio.sleep(3600)
+        self.assertEqual(self.loop.time(), 3600)
+        self.assertLess(time.perf_counter() - start, 1)
+
+    async def test_stress(self):
+        """大量获取、归还、超时、回收交替进行后，连接池状态保持一致"""
+        rnd = random.Random(12345)
+        pool = Pool(2, 8, 5, loop=self.loop, reap_interval=1, idle_timeout=3)
+        outcome = {"ok": 0, "timeout": 0}
+
+        async def worker():
+            await asyncio.sleep(rnd.uniform(0, 60))
+            try:
+                async with pool.acquire(timeout=rnd.choice([0.5, 2, None])):
+                    await asyncio.sleep(rnd.expovariate(2))
+                outcome["ok"] += 1
+            except TimeoutError:
+                outcome["timeout"] += 1
+
+        await asyncio.gather(*(worker() for _ in range(3000)))
+        self.assertEqual(outcome["ok"] + outcome["timeout"], 3000)
+        self.assertGreater(outcome["timeout"], 0)
+        self.assertEqual(len(pool._used), 0)
+        self.assertEqual(pool.stats()["waiters"], 0)
+        self.assertLessEqual(pool.size, 8)
+        await asyncio.sleep(10)
+        self.assertEqual(pool.size, 2)
+        self.assertGreater(pool.stats()["recycled"] + pool.stats()["closed"], 0)
+        pool.close()
+        await pool.wait_closed()
+
+    async def test_multiplexed(self):
+        """多个通道共享连接，请求并发执行，响应按请求 ID 返回给各自的调用方"""
+        pool = Pool(0, 2, -1, loop=self.loop, multiplexed=True)
+        mpool = MultiplexedPool(pool, max_streams=4)
+        conns = set()
+
+        async def call(i):
+            async with mpool.acquire() as channel:
+                conns.add(channel.conn)
+                self.assertEqual(await channel.request(i), i)
+
+        start = self.loop.time()
+        await asyncio.gather(*(call(i) for i in range(8)))
+        self.assertAlmostEqual(self.loop.time() - start, Conn.latency)
+        self.assertEqual(len(conns), 2)
+        self.assertEqual(pool.freesize, 2)
+
+        # 超出通道数的请求等待通道归还
+        start = self.loop.time()
+        await asyncio.gather(*(call(i) for i in range(16)))
+        self.assertAlmostEqual(self.loop.time() - start, 2 * Conn.latency)
+        self.assertEqual(pool.size, 2)
+
+    async def test_multiplexed_waiter_cancelled(self):
+        """为等待者保留的空闲连接，在等待者被取消后归还给连接池"""
+        pool = Pool(0, 1, -1, loop=self.loop, multiplexed=True)
+        mpool = MultiplexedPool(pool, max_streams=1)
+        channel = await mpool._acquire()
+        task = self.loop.create_task(mpool._acquire())
+        await asyncio.sleep(0)
+        mpool.release(channel)
+        self.assertEqual(pool.freesize, 0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(mpool._streams, {})
+        self.assertEqual(pool.freesize, 1)
+
+    async def test_connect_backoff_and_breaker(self):
+        """建连失败后指数退避，连续失败后熔断，后端恢复后探测连接自动恢复"""
+        backend_up = False
+        attempts = []
+
+        async def flaky_connect():
+            attempts.append(self.loop.time())
+            if not backend_up:
+                raise ConnectionError("backend down")
+            return await Conn.create()
+
+        pool = Pool(1, 2, -1, loop=self.loop, connect_backoff=0.1, breaker_threshold=3)
+        with mock.patch("src.basic.pool.pool.connect", flaky_connect):
+            for _ in range(3):
+                with self.assertRaises(ConnectionError):
+                    await pool._acquire()
+            gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+            self.assertTrue(0.05 <= gaps[0] < 0.1)
+            self.assertTrue(0.1 <= gaps[1] < 0.2)
+            with self.assertRaises(CircuitOpenError):
+                await pool._acquire()
+            self.assertEqual(len(attempts), 3)
+
+            backend_up = True
+            await asyncio.sleep(10)
+            self.assertFalse(pool._breaker_open)
+            self.assertEqual(pool.freesize, 1)
+            async with pool.acquire():
+                pass
+
+    async def test_affinity_key(self):
+        """acquire(key=...) 优先分配上次以同一个键借出的空闲连接，没有时分配任意空闲连接"""
+        pool = Pool(0, 3, -1, loop=self.loop)
+        a = await pool._acquire(key="tenant-a")
+        b = await pool._acquire(key="tenant-b")
+        c = await pool._acquire()
+        for conn in (a, b, c):
+            pool.release(conn)
+        async with pool.acquire(key="tenant-b") as conn:
+            self.assertIs(conn, b)
+        async with pool.acquire(key="tenant-a") as conn:
+            self.assertIs(conn, a)
+        # 没有该键的空闲连接时按 free_policy 分配，连接改为记录新的键
+        conn = await pool._acquire(key="tenant-c")
+        self.assertIs(conn, c)
+        self.assertEqual(conn.affinity_key, "tenant-c")
+        pool.release(conn)
+        # 不带键获取连接不改变连接记录的键
+        async with pool.acquire() as conn:
+            self.assertIs(conn, b)
+        self.assertEqual(b.affinity_key, "tenant-b")
+        async with pool.acquire(key="tenant-b") as conn:
+            self.assertIs(conn, b)
+
+    async def test_priority(self):
+        """优先级高的等待者先拿到连接，低优先级被插队 starvation_limit 次后服务一次"""
+        expected = {
+            None: ["i0", "i1", "i2", "b0", "b1", "b2"],
+            2: ["i0", "i1", "b0", "i2", "b1", "b2"],
+        }
+        for limit, order in expected.items():
+            pool = Pool(1, 1, -1, loop=self.loop, starvation_limit=limit)
+            served = []
+
+            async def waiter(name, priority):
+                async with pool.acquire(priority=priority):
+                    served.append(name)
+
+            async with pool.acquire():
+                # 批处理任务先排队，交互请求后到
+                tasks = [self.loop.create_task(waiter(f"b{i}", 1)) for i in range(3)]
+                await asyncio.sleep(0)
+                tasks += [self.loop.create_task(waiter(f"i{i}", 0)) for i in range(3)]
+                await asyncio.sleep(0)
+                self.assertEqual(len(pool._waiters), 6)
+            await asyncio.gather(*tasks)
+            self.assertEqual(served, order, limit)
+
+
+    async def test_acquire_many(self):
+        """acquire_many() 要么一次拿到全部连接，要么排队期间不把部分连接交给调用方"""
+        pool = Pool(4, 4, -1, loop=self.loop)
+        await pool.warmup()
+        async with pool.acquire_many(3) as conns:
+            self.assertEqual(len(set(conns)), 3)
+            self.assertEqual(pool.freesize, 1)
+        self.assertEqual(pool.freesize, 4)
+
+        held = [await pool._acquire() for _ in range(3)]
+        many = self.loop.create_task(pool._acquire_many(2))
+        await asyncio.sleep(0)
+        single = self.loop.create_task(pool._acquire())
+        await asyncio.sleep(0)
+        # 空闲的 1 个连接留给 acquire_many()，后来的 acquire() 不能拿走
+        self.assertFalse(many.done())
+        self.assertEqual(pool.freesize, 0)
+        self.assertEqual(pool._nwaiters, 2)
+        pool.release(held.pop())
+        conns = await many
+        self.assertEqual(len(conns), 2)
+        self.assertFalse(single.done())
+        pool.release(held.pop())
+        await single
+        for conn in conns + held + [single.result()]:
+            pool.release(conn)
+
+        # 超时时归还已经分到的连接
+        held = [await pool._acquire() for _ in range(3)]
+        with self.assertRaises(TimeoutError):
+            await pool._acquire_many(3, timeout=0.1)
+        self.assertEqual(pool.freesize, 1)
+        self.assertEqual(pool._nwaiters, 0)
+        with self.assertRaises(ValueError):
+            pool.acquire_many(5)
+
+        # 不同优先级的 acquire_many()：先分到连接的等待者凑齐之前，高优先级的等待者也不能拿走连接
+        for conn in held:
+            pool.release(conn)
+        self.assertEqual(pool.freesize, 4)
+        held = [await pool._acquire() for _ in range(4)]
+        low = self.loop.create_task(pool._acquire_many(3, priority=1))
+        await asyncio.sleep(0)
+        pool.release(held.pop())
+        pool.release(held.pop())
+        high = self.loop.create_task(pool._acquire_many(3, priority=0))
+        await asyncio.sleep(0)
+        pool.release(held.pop())
+        pool.release(held.pop())
+        conns = await low
+        self.assertEqual(len(conns), 3)
+        self.assertFalse(high.done())
+        for conn in conns:
+            pool.release(conn)
+        self.assertEqual(len(await high), 3)
+
+    async def test_acquire_many_batched_connect(self):
+        """缺少的连接并发创建，耗时约为一次建连"""
+        async def slow_connect():
+            await asyncio.sleep(0.05)
+            return await Conn.create()
+
+        pool = Pool(0, 5, -1, loop=self.loop)
+        with mock.patch("src.basic.pool.pool.connect", slow_connect):
+            start = self.loop.time()
+            async with pool.acquire_many(5) as conns:
+                self.assertEqual(self.loop.time() - start, 0.05)
+                self.assertEqual(len(conns), 5)
+        self.assertEqual(pool.size, 5)
+
+
+class TestTcpBackend(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await LatencyServer(latency=0.001, jitter=0.001, seed=1).start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_requests(self):
+        pool = Pool(1, 4, -1, loop=self.loop, host=self.server.host, port=self.server.port)
+
+        async def worker(i):
+            for j in range(10):
+                async with pool.acquire() as conn:
+                    self.assertEqual(await conn.request(f"{i}-{j}"), f"{i}-{j}")
+
+        await asyncio.gather(*(worker(i) for i in range(8)))
+        self.assertEqual(self.server.requests, 80)
+        self.assertLessEqual(self.server.accepted, 4)
+        pool.close()
+        await pool.wait_closed()
+
+    async def test_socket_failure(self):
+        """后端断开的连接不会再被分配"""
+        pool = Pool(1, 1, -1, loop=self.loop, host=self.server.host, port=self.server.port)
+        self.server.error_rate = 1.0
+        with self.assertRaises(ConnectionError):
+            async with pool.acquire() as conn:
+                await conn.request("x")
+        self.server.error_rate = 0.0
+        async with pool.acquire() as conn2:
+            self.assertIsNot(conn, conn2)
+            self.assertEqual(await conn2.request("y"), "y")
+        pool.close()
+        await pool.wait_closed()
+
+    async def test_accept_rate(self):
+        self.server.accept_rate = 50
+        pool = Pool(5, 5, -1, loop=self.loop, host=self.server.host, port=self.server.port)
+        start = self.loop.time()
+        await pool.warmup()
+        self.assertGreaterEqual(self.loop.time() - start, 0.07)
+        pool.close()
+        await pool.wait_closed()
+
+
+class TestThreadSafePool(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def test_threads_share_pool(self):
+        """多个线程共享同一组连接"""
+        pool = Pool(1, 3, -1, loop=self.loop)
+        tpool = ThreadSafePool(pool)
+        used = set()
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(50):
+                with tpool.connection() as conn:
+                    with lock:
+                        used.add(conn.id)
+                    time.sleep(0.001)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLessEqual(len(used), 3)
+        self.assertEqual(pool.size, len(used))
+
+    def test_timeout(self):
+        pool = Pool(1, 1, -1, loop=self.loop)
+        tpool = ThreadSafePool(pool)
+        conn = tpool.acquire()
+        with self.assertRaises(TimeoutError):
+            tpool.acquire(timeout=0.05)
+        tpool.release(conn)
+        with tpool.connection(timeout=0.05) as conn2:
+            self.assertIs(conn, conn2)
+
+
+class TestShardedPool(unittest.TestCase):
+
+    def setUp(self):
+        self.loops = [asyncio.new_event_loop() for _ in range(2)]
+        self.threads = [threading.Thread(target=loop.run_forever) for loop in self.loops]
+        for t in self.threads:
+            t.start()
+
+    def tearDown(self):
+        for loop, t in zip(self.loops, self.threads):
+            loop.call_soon_threadsafe(loop.stop)
+            t.join()
+            loop.close()
+
+    def run_in(self, loop, coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(5)
+
+    def test_rebalance(self):
+        """忙碌的分片从空闲分片拿到容量，总连接数不超过全局 maxsize"""
+        pool = ShardedPool(0, 4, -1, rebalance_interval=0.01)
+        busy, idle = self.loops
+
+        async def burst(n):
+            async def use():
+                async with pool.acquire(timeout=1) as conn:
+                    await asyncio.sleep(0.05)
+                    return conn
+            return await asyncio.gather(*(use() for _ in range(n)))
+
+        conns = self.run_in(idle, burst(4))
+        self.assertEqual(len({c.id for c in conns}), 4)
+        self.assertEqual(pool.size, 4)
+
+        conns = self.run_in(busy, burst(3))
+        self.assertEqual(len({c.id for c in conns}), 3)
+        self.assertLessEqual(pool.size, 4)
+        self.assertEqual(pool._shards[busy].maxsize + pool._shards[idle].maxsize
+                         + pool._spare, 4)
+
+        self.run_in(busy, pool.wait_closed())
+        self.assertEqual(pool.size, 0)
+
+
 if __name__ == "__main__":
-    # asyncio.run(test_pool())
-    loop.run_until_complete(test_pool())
+    pypath = os.environ.get("PYTHONPATH")
+    print(f"pypath: {pypath}")
+    asyncio.run(demo_pool())
@@ -0,0 +1,87 @@
+""" 线程安全的连接池门面
+    Pool 绑定在一个事件循环上，普通线程不能直接调用它的方法。ThreadSafePool 把获取、归还请求放进队列，
+    再通过 call_soon_threadsafe 交给连接池所在的事件循环执行，多个线程共享同一组连接。
+
+    跨线程唤醒事件循环需要写 self-pipe，代价较高，所以请求会批量处理：
+    队列中已有未处理的请求时，新的请求只入队，不再重复唤醒。
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import threading
+from src.basic.pool.utils import _PoolConnectionContextManager
+
+
+class ThreadSafePool:
+    """供同步线程使用的连接池门面
+
+    用法:
+        tpool = ThreadSafePool(pool)
+        with tpool.connection() as conn:
+            ...
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._loop = pool._loop
+        # 待事件循环处理的请求，deque 的 append/popleft 是线程安全的
+        self._pending = collections.deque()
+        # 是否已经唤醒事件循环处理队列
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """在当前线程阻塞获取连接，超时由连接池所在的事件循环控制，保证超时后不会泄漏连接"""
+        self._check_thread()
+        fut = concurrent.futures.Future()
+        self._submit((fut, timeout))
+        return fut.result()
+
+    def release(self, conn):
+        """归还连接，不等待事件循环处理完成"""
+        self._submit(conn)
+
+    def connection(self, timeout=None):
+        """获取连接并返回同步上下文管理器，退出时归还连接"""
+        conn = self.acquire(timeout)
+        return _PoolConnectionContextManager(self, conn)
+
+    def _check_thread(self):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if running is self._loop:
+            raise RuntimeError("ThreadSafePool.acquire() would block the pool's own event loop, "
+                               "use pool.acquire() instead")
+
+    def _submit(self, item):
+        self._pending.append(item)
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._loop.call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        """在事件循环线程中一次处理队列中所有的请求"""
+        with self._lock:
+            # 先复位再处理，处理期间新入队的请求会重新唤醒事件循环
+            self._scheduled = False
+        while self._pending:
+            item = self._pending.popleft()
+            if isinstance(item, tuple):
+                fut, timeout = item
+                task = self._loop.create_task(self._pool._acquire(timeout))
+                task.add_done_callback(lambda t, fut=fut: self._deliver(t, fut))
+            else:
+                self._pool.release(item)
+
+    def _deliver(self, task, fut):
+        if task.cancelled():
+            fut.cancel()
+        elif task.exception() is not None:
+            fut.set_exception(task.exception())
+        else:
+            fut.set_result(task.result())
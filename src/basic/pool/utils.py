@@ -1,3 +1,4 @@
+import asyncio
 from typing import Coroutine
 
 
@@ -89,12 +90,35 @@ class _PoolAcquireContextManager(_ContextManager):
 
     async def __aexit__(self, exc_type, exc, tb):
         try:
-            await self._pool.release(self._conn)
+            # release() 是同步完成的，shield 避免当前协程被取消时连带取消 release() 调度的唤醒任务
+            await asyncio.shield(self._pool.release(self._conn))
         finally:
             self._pool = None
             self._conn = None
 
 
+class _PoolAcquireManyContextManager(_ContextManager):
+    """acquire_many() 返回的上下文管理器，进入时得到连接列表，退出时归还全部连接"""
+
+    __slots__ = ('_coro', '_conns', '_pool')
+
+    def __init__(self, coro, pool):
+        self._coro = coro
+        self._conns = None
+        self._pool = pool
+
+    async def __aenter__(self):
+        self._conns = await self._coro
+        return self._conns
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await asyncio.shield(asyncio.gather(*[self._pool.release(conn) for conn in self._conns]))
+        finally:
+            self._pool = None
+            self._conns = None
+
+
 class _PoolConnectionContextManager:
     """Context manager.
 
@@ -0,0 +1,52 @@
+""" 虚拟时钟事件循环，用于连接池测试
+    事件循环没有就绪的回调和 I/O 事件时，不再阻塞等待最近的定时器，而是直接把时钟拨到定时器的触发时间，
+    所以 asyncio.sleep()、asyncio.timeout()、loop.call_later() 都瞬间完成，且执行顺序和真实时间下一致、可复现。
+
+    注意：等待真实 I/O（socket）的同时存在定时器时，时钟会跳过去触发定时器，
+    这种场景（比如 TCP 后端）应使用普通事件循环。
+"""
+
+import asyncio
+import selectors
+import unittest
+
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        # 先非阻塞地检查真实 I/O（至少包括事件循环自己的 self-pipe）
+        events = super().select(0)
+        if events or timeout is None:
+            # 没有任何定时器时只能等待真实 I/O（比如其他线程 call_soon_threadsafe）
+            return events or super().select(None)
+        # 没有 I/O 事件，直接推进时钟到下一个定时器
+        self.now += timeout
+        return events
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """loop.time() 返回虚拟时间的事件循环"""
+
+    def __init__(self):
+        self._virtual_selector = _VirtualTimeSelector()
+        super().__init__(self._virtual_selector)
+
+    def time(self):
+        return self._virtual_selector.now
+
+
+class VirtualTimeTestCase(unittest.IsolatedAsyncioTestCase):
+    """在 VirtualTimeEventLoop 上运行的异步测试用例"""
+
+    # Python 3.13+ 的 IsolatedAsyncioTestCase 支持 loop_factory
+    loop_factory = VirtualTimeEventLoop
+
+    def _setupAsyncioRunner(self):
+        # Python 3.12 的 IsolatedAsyncioTestCase 不支持 loop_factory，只能覆盖这个内部方法
+        # 关闭 debug 模式：debug 模式为每个回调记录调用栈，大量任务时会慢一个数量级
+        assert self._asyncioRunner is None, 'asyncio runner is already initialized'
+        self._asyncioRunner = asyncio.Runner(debug=False, loop_factory=VirtualTimeEventLoop)